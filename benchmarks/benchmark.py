@@ -0,0 +1,194 @@
+"""Benchmark makejinja on synthetic template trees.
+
+Generates an input tree with the given shape, renders it multiple times, and appends the timings
+(end to end and per stage of the run) as a JSON line to the output file,
+so that results of different commits can be compared.
+All timings are wall-clock durations except `write_cumulative`,
+which sums the time spent writing outputs over all templates (and thus all workers).
+
+Usage: `python benchmarks/benchmark.py --files 5000 --depth 4 --output benchmarks.jsonl`
+"""
+
+import json
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+import rich_click as click
+
+from makejinja.app import run
+from makejinja.config import Config, Internal
+
+STAGES = ("data", "env", "walk", "render", "postprocess")
+KEYS = ("total", *STAGES, "write_cumulative")
+
+
+def generate_tree(
+    root: Path,
+    files: int,
+    depth: int,
+    fanout: int,
+    data_keys: int,
+    template_ratio: float,
+    seed: int,
+) -> tuple[Path, Path]:
+    """Create an input directory and a data file, returning their paths."""
+    rng = random.Random(seed)
+    input_path = root / "input"
+    partials_path = input_path / "_partials"
+    data_path = root / "data.yaml"
+    partials_path.mkdir(parents=True)
+
+    with data_path.open("w") as fp:
+        for key in range(data_keys):
+            fp.write(f"key{key}:\n  name: Name {key}\n  values: [{key}, {key + 1}]\n")
+
+    (partials_path / "base.partial").write_text(
+        "<header>{{ title }}</header>\n{% block content %}{% endblock %}\n"
+    )
+
+    for partial in range(fanout):
+        (partials_path / f"partial{partial}.partial").write_text(
+            f"{{% for item in key{partial % max(data_keys, 1)}.get('values', []) %}}"
+            "{{ item }} {% endfor %}\n"
+        )
+
+    includes = "".join(
+        f"{{% include '_partials/partial{partial}.partial' %}}"
+        for partial in range(fanout)
+    )
+    template = (
+        "{% extends '_partials/base.partial' %}\n"
+        "{% set title = 'Page' %}\n"
+        f"{{% block content %}}{includes}{{{{ key0 | default('') }}}}{{% endblock %}}\n"
+    )
+
+    for file in range(files):
+        directory = input_path.joinpath(
+            *(f"dir{rng.randrange(4)}" for _ in range(rng.randint(0, depth)))
+        )
+        directory.mkdir(parents=True, exist_ok=True)
+
+        if rng.random() < template_ratio:
+            (directory / f"file{file}.txt.jinja").write_text(template)
+        else:
+            (directory / f"file{file}.bin").write_bytes(rng.randbytes(1024))
+
+    return input_path, data_path
+
+
+def benchmark(config: Config, profile_path: Path) -> dict[str, float]:
+    shutil.rmtree(config.output, ignore_errors=True)
+
+    start = time.perf_counter()
+    state = run(config)
+    timings = {"total": time.perf_counter() - start, **state.timings}
+
+    # Writing happens while rendering (possibly in parallel), so it is taken from the profile
+    # and not subtracted from the wall-clock duration of the render stage
+    with profile_path.open() as fp:
+        profile = json.load(fp)
+
+    timings["write_cumulative"] = sum(x["write"] for x in profile["templates"]) / 1000
+
+    return timings
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, check=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@click.command()
+@click.option("--files", default=1000, help="Number of files in the input tree.")
+@click.option("--depth", default=3, help="Maximum directory depth.")
+@click.option("--fanout", default=3, help="Number of templates included per template.")
+@click.option("--data-keys", default=1000, help="Number of entries in the data file.")
+@click.option(
+    "--template-ratio", default=0.8, help="Share of templates among the files."
+)
+@click.option("--jobs", default=1, help="Number of worker processes.")
+@click.option("--repeat", default=5, help="Number of measured runs.")
+@click.option("--seed", default=0, help="Seed of the generated tree.")
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=None,
+    help="JSON lines file the results are appended to (printed if omitted).",
+)
+def main(
+    files: int,
+    depth: int,
+    fanout: int,
+    data_keys: int,
+    template_ratio: float,
+    jobs: int,
+    repeat: int,
+    seed: int,
+    output: Path | None,
+) -> None:
+    """Benchmark makejinja on a synthetic template tree."""
+    params = {
+        "files": files,
+        "depth": depth,
+        "fanout": fanout,
+        "data_keys": data_keys,
+        "template_ratio": template_ratio,
+        "jobs": jobs,
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        input_path, data_path = generate_tree(
+            root, files, depth, fanout, data_keys, template_ratio, seed
+        )
+        profile_path = root / "profile.json"
+        config = Config(
+            inputs=(input_path,),
+            output=root / "output",
+            data=(data_path,),
+            exclude_patterns=("*.partial",),
+            jobs=jobs,
+            quiet=True,
+            profile_output=profile_path,
+            # Persistent caches would make the runs depend on each other
+            internal=Internal(data_cache=False),
+        )
+        runs = [benchmark(config, profile_path) for _ in range(repeat)]
+
+    result: dict[str, Any] = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": params,
+        "median": {
+            key: statistics.median(timings[key] for timings in runs) for key in KEYS
+        },
+        "min": {key: min(timings[key] for timings in runs) for key in KEYS},
+    }
+    line = json.dumps(result)
+
+    if output is None:
+        click.echo(line)
+    else:
+        with output.open("a") as fp:
+            fp.write(line + "\n")
+
+        click.echo(
+            " ".join(f"{key}={value:.3f}s" for key, value in result["median"].items()),
+            err=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -11,9 +11,39 @@
 While mainly intended to be used as a command line tool, makejinja can also be from Python directly.
 """
 
-from . import cli, config, plugin
-from .app import makejinja
+import importlib
+import typing as t
 
-loader = plugin
+if t.TYPE_CHECKING:
+    from . import cli, config, plugin
+    from .app import makejinja
+
+    loader = plugin
 
 __all__ = ["makejinja", "config", "plugin", "loader", "cli"]
+
+# The submodules are imported on first access to keep the startup of the CLI fast
+_LAZY_ATTRIBUTES = {
+    "cli": (".cli", None),
+    "config": (".config", None),
+    "plugin": (".plugin", None),
+    "loader": (".plugin", None),
+    "makejinja": (".app", "makejinja"),
+}
+
+
+def __getattr__(name: str) -> t.Any:
+    try:
+        module_name, attribute = _LAZY_ATTRIBUTES[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+
+    module = importlib.import_module(module_name, __name__)
+    value = module if attribute is None else getattr(module, attribute)
+    globals()[name] = value
+
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted({*globals(), *__all__})
@@ -1,49 +1,241 @@
+import codecs
+import errno
+import filecmp
+import functools
 import itertools
 import json
+import locale
 import os
+import posixpath
 import shutil
-import subprocess
 import sys
-import tomllib
-from collections import abc
+import time
+from collections import Counter, OrderedDict, abc
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from contextvars import ContextVar
+from dataclasses import dataclass, field, replace
+from enum import Enum
+from functools import partial
 from inspect import signature
 from pathlib import Path
+from stat import S_ISREG
+from types import ModuleType
 from typing import Any
 
 import rich_click as click
-import yaml
-from jinja2 import BaseLoader, ChoiceLoader, DictLoader, Environment, FileSystemLoader
+from jinja2 import (
+    BaseLoader,
+    ChoiceLoader,
+    DictLoader,
+    Environment,
+    FileSystemLoader,
+    Template,
+    TemplateError,
+    TemplateNotFound,
+)
 from jinja2.environment import load_extensions
+from jinja2.loaders import split_template_path
+from jinja2.runtime import Context, missing
 from jinja2.utils import import_string
 
-from makejinja.config import Config
-from makejinja.plugin import Data, MutableData, PathFilter, Plugin
+from makejinja.cache import (
+    PICKLING_ERRORS,
+    init_bytecode_cache,
+    init_data_cache,
+    memoize,
+)
+from makejinja.config import Config, CopyMode
+from makejinja.copying import copy_file
+from makejinja.manifest import (
+    MANIFEST_NAME,
+    Entry,
+    Manifest,
+    copy_entry,
+    is_up_to_date,
+    manifest_context,
+    template_entry,
+)
+from makejinja.merging import DataMerger
+from makejinja.plugin import (
+    Data,
+    DataLoader,
+    MutableData,
+    PathFilter,
+    Plugin,
+)
+from makejinja.profiling import (
+    Stopwatch,
+    TaskProfile,
+    format_profile,
+    phase,
+    profile_task,
+    profiled,
+    write_profile,
+)
+from makejinja.walk import Listings, PathMatcher, listing_key, walk
 
 __all__ = ["makejinja"]
 
 STDOUT_PATH = Path("/dev/stdout").resolve()
 STDIN_PATH = Path("/dev/stdin").resolve()
+# Same encoding as used by `open` in text mode
+ENCODING = locale.getpreferredencoding(False)
+COMPARE_CHUNK_SIZE = 1024 * 1024
+STREAM_BUFFER_SIZE = 1024 * 1024
+
+# Key: absolute path and loader of a data file
+_parsed_data: dict[tuple[str, DataLoader], dict[str, Any]] = {}
+_captured_log: ContextVar[list[str] | None] = ContextVar("captured_log", default=None)
+
+
+@functools.cache
+def input_errors() -> tuple[type[Exception], ...]:
+    """Errors caused by the inputs of a run (e.g., invalid templates or data) rather than by makejinja itself."""
+    # Only imported once an error is handled since PyYAML is not needed without YAML data
+    import yaml
+
+    return (TemplateError, OSError, ValueError, TypeError, LookupError, yaml.YAMLError)
 
 
 def log(message: str, config: Config) -> None:
     if not config.quiet:
-        click.echo(message, err=True)
+        emit(message)
+
+
+def emit(message: str, err: bool = True) -> None:
+    """Print a message or add it to the captured log messages (e.g., of a job run by a server)."""
+    if (messages := _captured_log.get()) is not None:
+        messages.append(message)
+    else:
+        click.echo(message, err=err)
+
+
+@contextmanager
+def capture_log() -> abc.Iterator[list[str]]:
+    """Collect log messages instead of printing them so that they can be replayed in order later on."""
+    messages: list[str] = []
+    token = _captured_log.set(messages)
+
+    try:
+        yield messages
+    finally:
+        _captured_log.reset(token)
+
+
+@dataclass(slots=True, frozen=True)
+class RenderTask:
+    """A file discovered in one of the input directories that shall be rendered or copied."""
+
+    input: Path
+    template_name: str
+    output: Path
+    enforce_jinja_suffix: bool
+    # Replace an existing output even without `--force` (e.g., if it is stale)
+    overwrite: bool = False
+
+
+class Outcome(Enum):
+    """What happened to an output file."""
+
+    rendered = "rendered"
+    copied = "copied"
+    cloned = "cloned"
+    linked = "linked"
+    unchanged = "unchanged"
+    up_to_date = "up to date"
+    empty = "empty"
+    skipped = "skipped"
+
+
+COPY_OUTCOMES = {
+    CopyMode.copy: Outcome.copied,
+    CopyMode.reflink: Outcome.cloned,
+    CopyMode.hardlink: Outcome.linked,
+    CopyMode.symlink: Outcome.linked,
+}
+COPY_MESSAGES = {
+    CopyMode.copy: "Copy",
+    CopyMode.reflink: "Clone",
+    CopyMode.hardlink: "Hard link",
+    CopyMode.symlink: "Symlink",
+}
+
+
+@dataclass(slots=True, frozen=True)
+class RenderResult:
+    task: RenderTask
+    outcome: Outcome
+    messages: list[str]
+    entry: Entry | None = None
+    copied_bytes: int = 0
+    profile: TaskProfile | None = None
+
+
+@dataclass(slots=True, frozen=True)
+class PathStep:
+    """An excluded path or a dir handled while walking the input dirs."""
+
+    path: Path
+    output: Path
+    messages: list[str]
+    excluded: bool = False
+    # The output dir has been (or would be) created
+    created: bool = False
+
+
+# Render tasks are executed after walking the inputs, the other steps only hold their log messages
+Step = RenderTask | RenderResult | PathStep
 
 
 def exec(cmd: str) -> None:
+    import subprocess
+
     subprocess.run(cmd, shell=True, check=True)
 
 
+@dataclass(slots=True)
+class RunState:
+    """Everything set up during a run that is needed to render templates again (e.g., in watch mode)."""
+
+    data: dict[str, Any]
+    env: Environment
+    plugin_path_filters: list[PathFilter]
+    tasks: list[RenderTask]
+    rendered_dirs: dict[Path, Path]
+    listings: Listings
+    data_loaders: dict[str, DataLoader]
+    # Key: stage of the run, Value: duration in seconds
+    timings: dict[str, float] = field(default_factory=dict)
+
+
 def makejinja(config: Config) -> None:
     """makejinja can be used to automatically generate files from [Jinja templates](https://jinja.palletsprojects.com/en/3.1.x/templates/)."""
 
+    if config.plan:
+        from makejinja.planning import plan, print_plan
+
+        print_plan(plan(config))
+    elif config.merge_shards:
+        from makejinja.sharding import merge_shards
+
+        merge_shards(config)
+    else:
+        run(config)
+
+
+def run(config: Config) -> RunState:
     for cmd in config.exec_pre:
         exec(cmd)
 
     for path in config.import_paths:
         sys.path.append(str(path.resolve()))
 
-    data = load_data(config)
+    stopwatch = Stopwatch()
+    clear_parsed_data()
+    # Built once and shared by the global data and the file-specific data of all templates
+    data_loaders = collect_data_loaders(config)
+    data = load_data(config, data_loaders)
+    stopwatch.lap("data")
 
     if config.output.is_dir() and config.clean:
         log(f"Remove output '{config.output}'", config)
@@ -53,60 +245,150 @@ def makejinja(config: Config) -> None:
     if not single_input_output_file(config):
         config.output.mkdir(exist_ok=True, parents=True)
 
-    env = init_jinja_env(config, data)
-    plugins: list[Plugin] = []
+    # Filled while walking the input dirs so that templates can be found without probing every input dir
+    listings: Listings = {}
+    env = init_jinja_env(config, data, listings)
+    plugins = load_plugins(env, data, config)
+    plugin_path_filters = collect_path_filters(plugins)
+    stopwatch.lap("env")
 
-    for plugin_name in itertools.chain(config.plugins, config.loaders):
-        plugins.append(load_plugin(plugin_name, env, data, config))
-
-    plugin_path_filters: list[PathFilter] = []
-
-    for plugin in plugins:
-        if hasattr(plugin, "path_filters"):
-            plugin_path_filters.extend(plugin.path_filters())
+    steps, rendered_dirs = walk_inputs(
+        config, env, plugin_path_filters, data_loaders, listings
+    )
+    tasks = [step for step in steps if isinstance(step, RenderTask)]
 
-    # Save rendered files to avoid duplicate work
-    # Even if two files are in two separate dirs, they will have the same template name (i.e., relative path)
-    # and thus only the first one will be rendered every time
-    # Key: output_path, Value: input_path
-    rendered_files: dict[Path, Path] = {}
+    # All shards partition the same tasks, so this has to happen before skipping up-to-date ones
+    if config.shard is not None:
+        from makejinja.sharding import select_shard
 
-    # Save rendered dirs to later copy metadata
-    # Key: output_path, Value: input_path
-    rendered_dirs: dict[Path, Path] = {}
+        steps = select_shard(steps, config)
 
-    for user_input_path in config.inputs:
-        if user_input_path.is_file() or user_input_path == STDIN_PATH:
-            handle_input_file(user_input_path, config, env, rendered_files)
-        elif user_input_path.is_dir():
-            handle_input_dir(
-                user_input_path,
+    if incremental := config.incremental and not single_input_output_file(config):
+        manifest_path = config.output / MANIFEST_NAME
+        previous_manifest = Manifest.load(manifest_path)
+        manifest = Manifest(
+            manifest_context(
                 config,
-                env,
-                rendered_files,
-                rendered_dirs,
-                plugin_path_filters,
+                collect_files(config.data),
+                itertools.chain(config.plugins, config.loaders),
             )
+        )
+        steps = apply_manifest(steps, previous_manifest, manifest, config, env)
+
+    stopwatch.lap("walk")
+    results = render_steps(steps, config, env, data, data_loaders, listings)
+
+    if incremental:
+        update_manifest(results, previous_manifest, manifest, config)
+        manifest.dump(manifest_path)
 
-    postprocess_rendered_dirs(config, rendered_dirs)
+    stopwatch.lap("render")
+
+    # Other shards may still add files to dirs that are empty here (see `merge_shards`)
+    if config.shard is None:
+        postprocess_rendered_dirs(config, rendered_dirs, output_counts(results))
+
+    stopwatch.lap("postprocess")
+    log_summary(results, config)
+
+    profiles = [result.profile for result in results if result.profile]
+
+    if config.profile:
+        emit(format_profile(profiles))
+
+    if config.profile_output is not None:
+        write_profile(profiles, config.profile_output, config.profile_format)
 
     for cmd in config.exec_post:
         exec(cmd)
 
+    return RunState(
+        data,
+        env,
+        plugin_path_filters,
+        tasks,
+        rendered_dirs,
+        listings,
+        data_loaders,
+        stopwatch.laps,
+    )
+
+
+def log_summary(results: abc.Iterable[RenderResult], config: Config) -> None:
+    counts = Counter(result.outcome for result in results)
+    copied_bytes = sum(result.copied_bytes for result in results)
+
+    if counts:
+        summary = ", ".join(
+            f"{counts[outcome]} {outcome.value}"
+            + (f" ({format_size(copied_bytes)})" if outcome is Outcome.copied else "")
+            for outcome in Outcome
+            if counts[outcome]
+        )
+        log(f"Summary: {summary}", config)
+
+
+def output_counts(results: abc.Iterable[RenderResult]) -> Counter[Path]:
+    """Count the files existing in every output dir after rendering (i.e., all outputs except empty ones)."""
+    return Counter(
+        result.task.output.parent
+        for result in results
+        if result.outcome is not Outcome.empty
+        # Empty outputs stay empty while they are up to date
+        and not (
+            result.outcome is Outcome.up_to_date
+            and result.entry is not None
+            and result.entry.get("empty")
+        )
+    )
+
+
+def format_size(size: float) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024:
+            break
+
+        size /= 1024
+    else:
+        unit = "TiB"
+
+    return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+
 
 def postprocess_rendered_dirs(
     config: Config,
     rendered_dirs: abc.Mapping[Path, Path],
+    child_counts: abc.Mapping[Path, int] | None = None,
 ) -> None:
+    """Remove empty dirs and copy the metadata of the remaining ones in a single bottom-up pass.
+
+    `child_counts` holds the number of files written to every dir during the run.
+    Dirs with written files are kept without listing them.
+    For all others, removing them is attempted, which fails if they contain files from elsewhere (e.g., previous runs).
+    """
+    # Dirs that are known to be non-empty (also because of kept child dirs)
+    counts = Counter(child_counts or {})
+
     # Start with the deepest directory and work our way up, otherwise the statistics could be modified after copying
     for output_path, input_path in sorted(
         rendered_dirs.items(), key=lambda x: x[0], reverse=True
     ):
-        if not config.keep_empty and not any(output_path.iterdir()):
-            log(f"Remove empty dir '{output_path}'", config)
-            shutil.rmtree(output_path)
+        if not config.keep_empty and not counts[output_path]:
+            try:
+                output_path.rmdir()
+            except FileNotFoundError:
+                # E.g., removed together with stale outputs
+                continue
+            except OSError as e:
+                if e.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+                    raise
+            else:
+                log(f"Remove empty dir '{output_path}'", config)
+                continue
+
+        counts[output_path.parent] += 1
 
-        elif config.copy_metadata:
+        if config.copy_metadata:
             log(f"Copy dir metadata '{input_path}' -> '{output_path}'", config)
             shutil.copystat(input_path, output_path)
 
@@ -125,24 +407,76 @@ def single_input_output_file(config: Config) -> bool:
     )
 
 
+def walk_inputs(
+    config: Config,
+    env: Environment,
+    plugin_path_filters: abc.Sequence[abc.Callable[[Path], bool]],
+    data_loaders: abc.Mapping[str, DataLoader],
+    listings: Listings | None = None,
+    dry_run: bool = False,
+) -> tuple[list[Step], dict[Path, Path]]:
+    """Collect the steps of all inputs and the rendered dirs.
+
+    With `dry_run`, nothing is rendered or created (e.g., to plan a run).
+    """
+    # Save rendered files to avoid duplicate work
+    # Even if two files are in two separate dirs, they will have the same template name (i.e., relative path)
+    # and thus only the first one will be rendered every time
+    # Key: output_path, Value: input_path
+    rendered_files: dict[Path, Path] = {}
+
+    # Save rendered dirs to later copy metadata
+    # Key: output_path, Value: input_path
+    rendered_dirs: dict[Path, Path] = {}
+
+    # Templates from input dirs are rendered after walking all inputs (possibly in parallel).
+    # The log messages emitted in between are kept to print everything in the original order.
+    steps: list[Step] = []
+
+    for user_input_path in config.inputs:
+        if user_input_path.is_file() or user_input_path == STDIN_PATH:
+            handle_input_file(
+                user_input_path,
+                config,
+                env,
+                data_loaders,
+                rendered_files,
+                steps,
+                dry_run,
+            )
+        elif user_input_path.is_dir():
+            handle_input_dir(
+                user_input_path,
+                config,
+                rendered_files,
+                rendered_dirs,
+                plugin_path_filters,
+                steps,
+                listings,
+                dry_run,
+            )
+
+    return steps, rendered_dirs
+
+
 def handle_input_file(
     input_path: Path,
     config: Config,
     env: Environment,
+    data_loaders: abc.Mapping[str, DataLoader],
     rendered_files: abc.MutableMapping[Path, Path],
+    steps: abc.MutableSequence[Step],
+    dry_run: bool = False,
 ) -> None:
     relative_path = Path(input_path.name)
     output_path = generate_output_path(config, relative_path)
 
     if output_path not in rendered_files:
-        render_file(
-            input_path,
-            str(relative_path),
-            output_path,
-            config,
-            env,
-            enforce_jinja_suffix=False,
+        task = RenderTask(
+            input_path, str(relative_path), output_path, enforce_jinja_suffix=False
         )
+        # Rendered right away since templates from stdin can only be read once
+        steps.append(task if dry_run else render_task(task, config, env, data_loaders))
 
     rendered_files[output_path] = input_path
 
@@ -150,52 +484,347 @@ def handle_input_file(
 def handle_input_dir(
     user_input_path: Path,
     config: Config,
-    env: Environment,
     rendered_files: abc.MutableMapping[Path, Path],
     rendered_dirs: abc.MutableMapping[Path, Path],
     plugin_path_filters: abc.Sequence[abc.Callable[[Path], bool]],
+    steps: abc.MutableSequence[Step],
+    listings: Listings | None = None,
+    dry_run: bool = False,
 ) -> None:
-    input_paths = (
-        input_path
-        for include_pattern in config.include_patterns
-        for input_path in sorted(user_input_path.glob(include_pattern))
+    matcher = PathMatcher.from_patterns(
+        config.include_patterns, config.exclude_patterns
     )
     # If the user provided a Jinja suffix, enforce it
     enforce_jinja_suffix = bool(config.jinja_suffix)
 
-    for input_path in input_paths:
-        relative_path = input_path.relative_to(user_input_path)
-        output_path = generate_output_path(config, relative_path)
+    for entry in walk(user_input_path, matcher, plugin_path_filters, listings):
+        input_path = entry.path
+        # Input dirs never produce a single output file, so the check is skipped
+        output_path = _output_path(config, entry.relative_path)
 
-        exclude_pattern_match = any(
-            input_path.match(x) for x in config.exclude_patterns
-        )
-        path_filter_match = any(
-            not path_filter(input_path) for path_filter in plugin_path_filters
-        )
-        if exclude_pattern_match or path_filter_match:
-            log(f"Skip excluded path '{input_path}'", config)
-
-        elif input_path.is_file() and output_path not in rendered_files:
-            render_file(
-                input_path,
-                str(relative_path),
-                output_path,
-                config,
-                env,
-                enforce_jinja_suffix,
+        if entry.excluded:
+            with capture_log() as messages:
+                log(f"Skip excluded path '{input_path}'", config)
+
+            steps.append(PathStep(input_path, output_path, messages, excluded=True))
+
+        elif entry.is_file and output_path not in rendered_files:
+            steps.append(
+                RenderTask(
+                    input_path,
+                    str(entry.relative_path),
+                    output_path,
+                    enforce_jinja_suffix,
+                )
             )
             rendered_files[output_path] = input_path
 
-        elif input_path.is_dir() and output_path not in rendered_dirs:
-            render_dir(input_path, output_path, config)
+        elif entry.is_dir and output_path not in rendered_dirs:
+            # Dirs are created right away so that they exist before their files are rendered
+            with capture_log() as messages:
+                created = render_dir(input_path, output_path, config, dry_run)
+
+            steps.append(PathStep(input_path, output_path, messages, created=created))
             rendered_dirs[output_path] = input_path
 
 
+def render_steps(
+    steps: abc.Sequence[Step],
+    config: Config,
+    env: Environment,
+    data: Data,
+    data_loaders: abc.Mapping[str, DataLoader],
+    listings: Listings | None = None,
+) -> list[RenderResult]:
+    """Render all collected tasks and print the log messages in the order of the steps."""
+    tasks = [step for step in steps if isinstance(step, RenderTask)]
+    jobs = config.jobs or os.cpu_count() or 1
+
+    # Templates from stdin cannot be read again by the worker processes
+    if jobs > 1 and len(tasks) > 1 and STDIN_PATH not in config.inputs:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(
+            max_workers=min(jobs, len(tasks)),
+            initializer=_init_worker,
+            initargs=(config, data, listings),
+        ) as executor:
+            chunksize = max(1, len(tasks) // (jobs * 4))
+            results = executor.map(_render_worker_task, tasks, chunksize=chunksize)
+
+            return _print_steps(steps, results)
+
+    if config.internal.enable_async and tasks:
+        import asyncio
+
+        results = iter(
+            asyncio.run(render_tasks_async(tasks, config, env, data_loaders))
+        )
+
+        return _print_steps(steps, results)
+
+    results = (render_task(task, config, env, data_loaders) for task in tasks)
+
+    return _print_steps(steps, results)
+
+
+def _print_steps(
+    steps: abc.Iterable[Step],
+    results: abc.Iterator[RenderResult],
+) -> list[RenderResult]:
+    collected_results: list[RenderResult] = []
+
+    for step in steps:
+        if isinstance(step, RenderTask):
+            step = next(results)
+
+        if isinstance(step, RenderResult):
+            collected_results.append(step)
+
+        # The messages have been captured while rendering and are replayed in the order of the steps
+        for message in step.messages:
+            emit(message)
+
+    return collected_results
+
+
+def render_task(
+    task: RenderTask,
+    config: Config,
+    env: Environment,
+    data_loaders: abc.Mapping[str, DataLoader],
+) -> RenderResult:
+    with (
+        capture_log() as messages,
+        _profile_task(task, config) as profile,
+    ):
+        outcome = render_file(
+            task.input,
+            task.template_name,
+            task.output,
+            config,
+            env,
+            data_loaders,
+            task.enforce_jinja_suffix,
+            task.overwrite,
+        )
+
+    return _task_result(task, outcome, messages, profile, config, env)
+
+
+async def render_task_async(
+    task: RenderTask,
+    config: Config,
+    env: Environment,
+    data_loaders: abc.Mapping[str, DataLoader],
+) -> RenderResult:
+    with (
+        capture_log() as messages,
+        _profile_task(task, config) as profile,
+    ):
+        outcome = await render_file_async(
+            task.input,
+            task.template_name,
+            task.output,
+            config,
+            env,
+            data_loaders,
+            task.enforce_jinja_suffix,
+            task.overwrite,
+        )
+
+    return _task_result(task, outcome, messages, profile, config, env)
+
+
+async def render_tasks_async(
+    tasks: abc.Iterable[RenderTask],
+    config: Config,
+    env: Environment,
+    data_loaders: abc.Mapping[str, DataLoader],
+) -> list[RenderResult]:
+    """Render the tasks concurrently so that async plugins (e.g., doing network requests) can overlap."""
+    import asyncio
+
+    semaphore = asyncio.Semaphore(config.internal.async_concurrency)
+
+    async def render(task: RenderTask) -> RenderResult:
+        async with semaphore:
+            return await render_task_async(task, config, env, data_loaders)
+
+    return await asyncio.gather(*(render(task) for task in tasks))
+
+
+def _profile_task(
+    task: RenderTask, config: Config
+) -> AbstractContextManager[TaskProfile | None]:
+    # Incremental builds record the durations in the manifest to estimate costs (see `plan`)
+    if config.profile or config.profile_output is not None or config.incremental:
+        return profile_task(task.template_name)
+
+    return nullcontext()
+
+
+def _task_result(
+    task: RenderTask,
+    outcome: Outcome,
+    messages: list[str],
+    profile: TaskProfile | None,
+    config: Config,
+    env: Environment,
+) -> RenderResult:
+    entry: Entry | None = None
+    copied_bytes = task.input.stat().st_size if outcome is Outcome.copied else 0
+
+    if config.incremental and outcome is not Outcome.skipped:
+        if not is_template(task.input, config, task.enforce_jinja_suffix):
+            entry = copy_entry(task.input)
+        else:
+            entry = template_entry(task.input, task.template_name, config, env)
+            entry["empty"] = outcome is Outcome.empty
+
+        if profile is not None:
+            entry["duration"] = round(profile.duration() / 1e9, 6)
+
+        # Keeps the output on this shard in later runs (see `select_shard`)
+        if config.shard is not None:
+            entry["shard"] = config.shard
+
+    return RenderResult(task, outcome, messages, entry, copied_bytes, profile)
+
+
+# Each worker process builds its own environment from the config
+_worker_config: Config | None = None
+_worker_env: Environment | None = None
+_worker_data_loaders: dict[str, DataLoader] | None = None
+
+
+def _init_worker(config: Config, data: Data, listings: Listings | None) -> None:
+    global _worker_config, _worker_env, _worker_data_loaders
+
+    for path in config.import_paths:
+        sys.path.append(str(path.resolve()))
+
+    env = init_jinja_env(config, data, listings)
+    load_plugins(env, data, config)
+
+    _worker_config = config
+    _worker_env = env
+    # Loaders registered by plugins are not necessarily picklable, so each worker collects them once
+    _worker_data_loaders = collect_data_loaders(config)
+
+
+def _render_worker_task(task: RenderTask) -> RenderResult:
+    assert _worker_config is not None and _worker_env is not None
+    assert _worker_data_loaders is not None
+
+    return render_task(task, _worker_config, _worker_env, _worker_data_loaders)
+
+
+def apply_manifest(
+    steps: abc.Iterable[Step],
+    previous_manifest: Manifest,
+    manifest: Manifest,
+    config: Config,
+    env: Environment,
+) -> list[Step]:
+    """Skip all tasks whose outputs are up to date and allow overwriting the stale ones."""
+    same_context = previous_manifest.context == manifest.context
+    new_steps: list[Step] = []
+
+    for step in steps:
+        if isinstance(step, RenderTask):
+            key = step.output.relative_to(config.output).as_posix()
+
+            if (entry := previous_manifest.outputs.get(key)) is not None:
+                if same_context and is_up_to_date(
+                    entry,
+                    step.input,
+                    step.template_name,
+                    step.output,
+                    is_template(step.input, config, step.enforce_jinja_suffix),
+                    config,
+                    env,
+                ):
+                    with capture_log() as messages:
+                        log(f"Skip up-to-date file '{step.output}'", config)
+
+                    step = RenderResult(step, Outcome.up_to_date, messages, entry)
+                else:
+                    step = replace(step, overwrite=True)
+
+        new_steps.append(step)
+
+    return new_steps
+
+
+def update_manifest(
+    results: abc.Iterable[RenderResult],
+    previous_manifest: Manifest,
+    manifest: Manifest,
+    config: Config,
+) -> None:
+    """Record the rendered outputs and remove the ones that are no longer produced by any input."""
+    current_outputs: set[str] = set()
+
+    for result in results:
+        task = result.task
+        key = task.output.relative_to(config.output).as_posix()
+        current_outputs.add(key)
+
+        if result.entry is not None:
+            manifest.outputs[key] = result.entry
+
+        # A template that now renders to an empty string leaves behind its previous output
+        if result.outcome is Outcome.empty and task.overwrite:
+            remove_stale_output(task.output, config)
+
+    # In shard runs, this includes outputs that are now assigned to another shard
+    for key in previous_manifest.outputs.keys() - current_outputs:
+        remove_stale_output(config.output / key, config)
+
+
+def remove_stale_output(output: Path, config: Config) -> None:
+    # Resolve `..` without following a symlinked output (e.g., from `--copy-mode symlink`)
+    output = Path(os.path.normpath(output))
+
+    # Paths are read from manifests (which may come from elsewhere, e.g., shard artifacts)
+    if not is_inside_output(output, config):
+        emit(f"Refusing to remove '{output}' outside of the output '{config.output}'")
+        return
+
+    if not output.is_file():
+        return
+
+    log(f"Remove stale file '{output}'", config)
+    output.unlink()
+
+    # Remove parent dirs that became empty, but never the output dir itself
+    for parent in output.parents:
+        if parent == config.output or config.output not in parent.parents:
+            break
+
+        try:
+            parent.rmdir()
+        except OSError:
+            break
+
+
+def is_inside_output(path: Path, config: Config) -> bool:
+    """Check whether `path` (without `..` components) is located in the output dir."""
+    output_dir = config.output.resolve()
+    resolved = path.parent.resolve() / path.name
+
+    return resolved != output_dir and resolved.is_relative_to(output_dir)
+
+
 def generate_output_path(config: Config, relative_path: Path) -> Path:
     if single_input_output_file(config):
         return config.output
 
+    return _output_path(config, relative_path)
+
+
+def _output_path(config: Config, relative_path: Path) -> Path:
     output_file = config.output / relative_path
 
     if relative_path.suffix == config.jinja_suffix and not config.keep_jinja_suffix:
@@ -207,6 +836,7 @@ def generate_output_path(config: Config, relative_path: Path) -> Path:
 def init_jinja_env(
     config: Config,
     data: Data,
+    listings: Listings | None = None,
 ) -> Environment:
     file_loader = DictLoader(
         {
@@ -215,7 +845,11 @@ def init_jinja_env(
             if path.is_file() or path == STDIN_PATH
         }
     )
-    dir_loader = FileSystemLoader([path for path in config.inputs if path.is_dir()])
+    dir_loader = ListingsLoader(
+        [path for path in config.inputs if path.is_dir()],
+        {} if listings is None else listings,
+        cache_size=config.internal.cache_size,
+    )
     loaders: list[BaseLoader] = [file_loader, dir_loader]
 
     env = Environment(
@@ -234,26 +868,213 @@ def init_jinja_env(
         newline_sequence=config.whitespace.newline_sequence,
         keep_trailing_newline=config.whitespace.keep_trailing_newline,
         optimized=config.internal.optimized,
-        undefined=config.undefined.value,
+        undefined=config.undefined.jinja_class,
         finalize=None,
         autoescape=config.internal.autoescape,
         cache_size=config.internal.cache_size,
         auto_reload=config.internal.auto_reload,
-        bytecode_cache=None,
+        bytecode_cache=init_bytecode_cache(config),
         enable_async=config.internal.enable_async,
     )
 
-    env.globals.update(data)
+    update_env_data(env, data)
     env.globals["env"] = os.environ
 
+    if config.lazy_data:
+        # Lazily loaded namespaces are mappings, but not dicts
+        env.policies["json.dumps_kwargs"] = {
+            **env.policies["json.dumps_kwargs"],
+            "default": _lazy_data_to_json,
+        }
+
     return env
 
 
+class ListingsLoader(FileSystemLoader):
+    """Like `FileSystemLoader`, but looks up templates in the directory listings recorded while walking the inputs.
+
+    `FileSystemLoader` probes every input dir until it finds a template, so with many inputs,
+    every `include` costs many `stat` calls.
+    Here, the input dirs that do not contain a template are skipped based on the listings
+    and only directories not scanned by the walk (e.g., excluded ones) are probed.
+    The sources are kept in memory and reused as long as the modification time of the file is unchanged.
+    Like the template cache of Jinja, at most `cache_size` sources are kept (`0` disables it, `-1` removes the limit).
+    """
+
+    def __init__(
+        self,
+        searchpath: abc.Sequence[str | os.PathLike[str]],
+        listings: Listings,
+        encoding: str = "utf-8",
+        cache_size: int = 400,
+    ) -> None:
+        super().__init__(searchpath, encoding)
+        self.listings = listings
+        self.cache_size = cache_size
+        # Key: filename, Value: modification time, size, and source (least recently used first)
+        self._sources: OrderedDict[str, tuple[int, int, str]] = OrderedDict()
+
+    def get_source(
+        self, environment: Environment, template: str
+    ) -> tuple[str, str, abc.Callable[[], bool]]:
+        pieces = split_template_path(template)
+
+        for searchpath in self.searchpath if pieces else ():
+            # Like `FileSystemLoader`, use posixpath even on Windows to avoid breaking out of the search directory
+            directory = posixpath.join(searchpath, *pieces[:-1])
+            names = self.listings.get(listing_key(directory))
+
+            if names is not None and pieces[-1] not in names:
+                continue
+
+            filename = posixpath.join(directory, pieces[-1])
+
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+
+            if not S_ISREG(stat.st_mode):
+                continue
+
+            cached = self._sources.get(filename)
+
+            if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+                self._sources.move_to_end(filename)
+                source = cached[2]
+            else:
+                with open(filename, encoding=self.encoding) as fp:
+                    source = fp.read()
+
+                self._store_source(filename, (stat.st_mtime_ns, stat.st_size, source))
+
+            return (
+                source,
+                os.path.normpath(filename),
+                partial(_is_unmodified, filename, stat.st_mtime_ns),
+            )
+
+        raise TemplateNotFound(template)
+
+    def _store_source(self, filename: str, entry: tuple[int, int, str]) -> None:
+        if self.cache_size == 0:
+            return
+
+        self._sources[filename] = entry
+        self._sources.move_to_end(filename)
+
+        if 0 < self.cache_size < len(self._sources):
+            self._sources.popitem(last=False)
+
+
+def _is_unmodified(filename: str, mtime_ns: int) -> bool:
+    try:
+        return os.stat(filename).st_mtime_ns == mtime_ns
+    except OSError:
+        return False
+
+
+def update_env_data(
+    env: Environment, data: Data, previous_data: Data | None = None
+) -> None:
+    if isinstance(data, LazyData):
+        # The keys are unknown until the data is loaded,
+        # so missing names are looked up in the data when rendering a template
+        env.context_class = _lazy_data_context(data)
+    else:
+        if previous_data is not None:
+            for key in previous_data.keys() - data.keys():
+                env.globals.pop(key, None)
+
+        env.globals.update(data)
+
+
+class LazyData(abc.MutableMapping[str, Any]):
+    """Mapping that is only loaded on first access (e.g., when a template uses it)."""
+
+    # Attributes are prefixed to not shadow keys accessed like `data.key` in templates
+    __slots__ = ("_data", "_load")
+
+    def __init__(self, load: abc.Callable[[], MutableData]) -> None:
+        self._load = load
+        self._data: MutableData | None = None
+
+    def _loaded(self) -> MutableData:
+        if self._data is None:
+            self._data = self._load()
+
+        return self._data
+
+    def __getitem__(self, key: str) -> Any:
+        return self._loaded()[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self._loaded()[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        del self._loaded()[key]
+
+    def __iter__(self) -> abc.Iterator[str]:
+        return iter(self._loaded())
+
+    def __len__(self) -> int:
+        return len(self._loaded())
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._loaded()
+
+    def __repr__(self) -> str:
+        if self._data is None:
+            return f"{type(self).__name__}(<not loaded>)"
+
+        return f"{type(self).__name__}({self._data!r})"
+
+
+def _lazy_data_context(data: LazyData) -> type[Context]:
+    class LazyDataContext(Context):
+        def resolve_or_missing(self, key: str) -> Any:
+            value = super().resolve_or_missing(key)
+
+            if value is missing:
+                return data.get(key, missing)
+
+            return value
+
+    return LazyDataContext
+
+
+def _lazy_data_to_json(value: Any) -> Any:
+    if isinstance(value, LazyData):
+        return dict(value)
+
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+@functools.cache
+def yaml_loader() -> type:
+    import yaml
+
+    # Prefer the bindings to libyaml if PyYAML has been built with them
+    return getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+@functools.cache
+def _orjson() -> ModuleType | None:
+    try:
+        import orjson
+    except ImportError:
+        return None
+
+    return orjson
+
+
 def from_yaml(path: Path) -> dict[str, Any]:
+    import yaml
+
     data = {}
 
     with path.open("rb") as fp:
-        for doc in yaml.safe_load_all(fp):
+        for doc in yaml.load_all(fp, Loader=yaml_loader()):
             if isinstance(doc, abc.Mapping):
                 data |= doc
             else:
@@ -265,6 +1086,8 @@ def from_yaml(path: Path) -> dict[str, Any]:
 
 
 def from_toml(path: Path) -> dict[str, Any]:
+    import tomllib
+
     with path.open("rb") as fp:
         data = tomllib.load(fp)
 
@@ -277,8 +1100,19 @@ def from_toml(path: Path) -> dict[str, Any]:
 
 
 def from_json(path: Path) -> dict[str, Any]:
+    orjson = _orjson()
+
     with path.open("rb") as fp:
-        data = json.load(fp)
+        if orjson is None:
+            data = json.load(fp)
+        else:
+            content = fp.read()
+
+            try:
+                data = orjson.loads(content)
+            except orjson.JSONDecodeError:
+                # The standard library accepts some extensions like `NaN`
+                data = json.loads(content)
 
     if isinstance(data, abc.Mapping):
         return data
@@ -288,7 +1122,7 @@ def from_json(path: Path) -> dict[str, Any]:
     )
 
 
-DATA_LOADERS: dict[str, abc.Callable[[Path], dict[str, Any]]] = {
+DATA_LOADERS: dict[str, DataLoader] = {
     ".yaml": from_yaml,
     ".yml": from_yaml,
     ".toml": from_toml,
@@ -296,6 +1130,48 @@ DATA_LOADERS: dict[str, abc.Callable[[Path], dict[str, Any]]] = {
 }
 
 
+def collect_data_loaders(config: Config) -> dict[str, DataLoader]:
+    """Combine the built-in data loaders with those registered by plugins and the config (in this order)."""
+    loaders = dict(DATA_LOADERS)
+
+    for plugin_name in itertools.chain(config.plugins, config.loaders):
+        cls: type[Plugin] = import_string(plugin_name)
+
+        if hasattr(cls, "data_loaders"):
+            loaders.update(_normalize_suffixes(cls.data_loaders()))
+
+    loaders.update(
+        _normalize_suffixes(
+            {
+                suffix: import_string(import_path)
+                for suffix, import_path in config.data_loaders.items()
+            }
+        )
+    )
+
+    return loaders
+
+
+def _normalize_suffixes(loaders: abc.Mapping[str, DataLoader]) -> dict[str, DataLoader]:
+    return {
+        suffix if suffix.startswith(".") else f".{suffix}": loader
+        for suffix, loader in loaders.items()
+    }
+
+
+def describe_data_loader(loader: DataLoader) -> str:
+    if loader is from_yaml:
+        return f"from_yaml ({yaml_loader().__name__})"
+
+    if loader is from_json:
+        return f"from_json ({'json' if _orjson() is None else 'orjson'})"
+
+    if loader.__module__ == __name__:
+        return loader.__qualname__
+
+    return f"{loader.__module__}.{loader.__qualname__}"
+
+
 def collect_files(paths: abc.Iterable[Path], pattern: str = "**/*") -> list[Path]:
     files = []
 
@@ -312,56 +1188,202 @@ def collect_files(paths: abc.Iterable[Path], pattern: str = "**/*") -> list[Path
     return files
 
 
-def dict_nested_set(data: MutableData, dotted_key: str, value: Any) -> None:
+def dict_nested_set(
+    data: MutableData,
+    dotted_key: str,
+    value: Any,
+    merger: DataMerger | None = None,
+) -> None:
     """Given `foo`, 'key1.key2.key3', 'something', set foo['key1']['key2']['key3'] = 'something'
 
-    Source: https://stackoverflow.com/a/57561744
+    Nested dictionaries along the path are copied instead of modified since they may be shared with other data
+    (e.g., parsed files used by multiple templates).
     """
+    (merger or DataMerger()).set(data, dotted_key.split("."), value)
 
-    # Start off pointing at the original dictionary that was passed in.
-    here = data
 
-    # Turn the string of key names into a list of strings.
-    keys = dotted_key.split(".")
+def load_data(
+    config: Config, loaders: abc.Mapping[str, DataLoader] | None = None
+) -> MutableData:
+    if loaders is None:
+        loaders = collect_data_loaders(config)
 
-    # For every key *before* the last one, we concentrate on navigating through the dictionary.
-    for key in keys[:-1]:
-        # Try to find here[key]. If it doesn't exist, create it with an empty dictionary. Then,
-        # update our `here` pointer to refer to the thing we just found (or created).
-        here = here.setdefault(key, {})
+    if config.lazy_data and not config.namespace_data:
+        return LazyData(partial(_load_data, config, loaders))
 
-    # Finally, set the final key to the given value
-    here[keys[-1]] = value
+    return _load_data(config, loaders)
 
 
-def load_data(config: Config) -> dict[str, Any]:
-    data: dict[str, Any] = {}
+def _load_data(config: Config, loaders: abc.Mapping[str, DataLoader]) -> MutableData:
+    data: MutableData = {}
+    merger = DataMerger(config.data_merge)
+    files = [
+        (data_path, path, loaders.get(path.suffix))
+        for data_path in config.data
+        for path in collect_files([data_path])
+    ]
 
-    for path in collect_files(config.data):
-        if loader := DATA_LOADERS.get(path.suffix):
-            log(f"Load data '{path}'", config)
+    if not config.lazy_data:
+        prefetch_data(
+            [(path, loader) for _, path, loader in files if loader is not None], config
+        )
 
-            data |= loader(path)
-        else:
+    for data_path, path, loader in files:
+        if loader is None:
             log(f"Skip unsupported data '{path}'", config)
+        elif config.namespace_data:
+            # E.g., `data/foo/bar.yaml` is stored as `foo.bar`
+            relative_path = (
+                path.relative_to(data_path) if data_path.is_dir() else Path(path.name)
+            )
+            merger.set(
+                data,
+                relative_path.with_suffix("").parts,
+                LazyData(partial(load_data_file, path, loader, config))
+                if config.lazy_data
+                else load_data_file(path, loader, config),
+            )
+        else:
+            merger.merge(data, load_data_file(path, loader, config))
 
     for key, value in config.data_vars.items():
-        dict_nested_set(data, key, value)
+        dict_nested_set(data, key, value, merger)
+
+    return data
+
+
+def prefetch_data(files: abc.Sequence[tuple[Path, DataLoader]], config: Config) -> None:
+    """Parse many data files in worker processes so that loading them afterwards (in order) only takes a lookup.
+
+    Files already parsed in this run or (most likely) stored in the data cache are skipped.
+    If fewer files than the threshold remain, starting the workers would take longer than parsing them serially.
+    """
+    jobs = config.jobs or os.cpu_count() or 1
+
+    if jobs <= 1 or len(files) < config.internal.data_jobs_threshold:
+        return
+
+    cache = init_data_cache(config)
+    # Key: loader, Value: whether it can be sent to the workers (checked once per loader)
+    picklable: dict[DataLoader, bool] = {}
+    pending: list[tuple[Path, DataLoader]] = []
+
+    for path, loader in files:
+        if loader not in picklable:
+            picklable[loader] = _is_picklable(loader)
+
+        if (
+            picklable[loader]
+            and (os.path.abspath(path), loader) not in _parsed_data
+            and (cache is None or not cache.is_fresh(path, loader))
+        ):
+            pending.append((path, loader))
+
+    if len(pending) < config.internal.data_jobs_threshold:
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(
+        max_workers=min(jobs, len(pending)),
+        initializer=_init_data_worker,
+        initargs=(config,),
+    ) as executor:
+        chunksize = max(1, len(pending) // (jobs * 4))
+        results = executor.map(_parse_data_worker, pending, chunksize=chunksize)
+
+        for (path, loader), data in zip(pending, results, strict=True):
+            if data is not None:
+                _parsed_data[(os.path.abspath(path), loader)] = data
+
+
+def _is_picklable(obj: Any) -> bool:
+    import pickle
+
+    try:
+        pickle.dumps(obj)
+    except PICKLING_ERRORS:
+        # E.g., lambdas or closures returned by plugins
+        return False
+
+    return True
+
+
+def _init_data_worker(config: Config) -> None:
+    global _worker_config
+
+    for path in config.import_paths:
+        sys.path.append(str(path.resolve()))
+
+    _worker_config = config
+
+
+def _parse_data_worker(file: tuple[Path, DataLoader]) -> dict[str, Any] | None:
+    assert _worker_config is not None
+
+    try:
+        return load_cached(*file, _worker_config)
+    except input_errors():
+        # The file is parsed again while loading the data, raising the error in order
+        return None
+
+
+def load_data_file(path: Path, loader: DataLoader, config: Config) -> dict[str, Any]:
+    if not config.verbose:
+        log(f"Load data '{path}'", config)
+
+        return load_cached(path, loader, config)
+
+    start = time.perf_counter()
+    data = load_cached(path, loader, config)
+    duration = (time.perf_counter() - start) * 1000
+
+    log(
+        f"Load data '{path}' using {describe_data_loader(loader)} ({duration:.1f} ms)",
+        config,
+    )
 
     return data
 
 
-def load_file_data(template_name: str, config: Config) -> dict[str, Any]:
+def load_cached(path: Path, loader: DataLoader, config: Config) -> dict[str, Any]:
+    """Parse a data file at most once per run.
+
+    The result is shared by all callers and must not be modified in place.
+    """
+    key = (os.path.abspath(path), loader)
+
+    if (data := _parsed_data.get(key)) is None:
+        if cache := init_data_cache(config):
+            data = cache.load(path, loader)
+        else:
+            data = loader(path)
+
+        _parsed_data[key] = data
+
+    return data
+
+
+def clear_parsed_data() -> None:
+    """Forget the data files parsed so far, e.g., after they have been modified."""
+    _parsed_data.clear()
+
+
+def load_file_data(
+    template_name: str, config: Config, loaders: abc.Mapping[str, DataLoader]
+) -> dict[str, Any]:
     file_data: dict[str, Any] = {}
 
     if data_paths := config.file_data.get(template_name):
+        merger = DataMerger(config.data_merge)
+
         for data_path in data_paths:
-            if data_path.exists() and (loader := DATA_LOADERS.get(data_path.suffix)):
+            if data_path.exists() and (loader := loaders.get(data_path.suffix)):
                 log(
                     f"Load file-specific data '{data_path}' for template '{template_name}'",
                     config,
                 )
-                file_data |= loader(data_path)
+                merger.merge(file_data, load_cached(data_path, loader, config))
             else:
                 log(
                     f"Skip missing or unsupported file-specific data '{data_path}'",
@@ -371,6 +1393,23 @@ def load_file_data(template_name: str, config: Config) -> dict[str, Any]:
     return file_data
 
 
+def collect_path_filters(plugins: abc.Iterable[Plugin]) -> list[PathFilter]:
+    plugin_path_filters: list[PathFilter] = []
+
+    for plugin in plugins:
+        if hasattr(plugin, "path_filters"):
+            plugin_path_filters.extend(plugin.path_filters())
+
+    return plugin_path_filters
+
+
+def load_plugins(env: Environment, data: Data, config: Config) -> list[Plugin]:
+    return [
+        load_plugin(plugin_name, env, data, config)
+        for plugin_name in itertools.chain(config.plugins, config.loaders)
+    ]
+
+
 def load_plugin(
     plugin_name: str, env: Environment, data: Data, config: Config
 ) -> Plugin:
@@ -390,10 +1429,20 @@ def load_plugin(
     plugin = cls(**params)
 
     if hasattr(plugin, "globals"):
-        env.globals.update({func.__name__: func for func in plugin.globals()})
+        env.globals.update(
+            {
+                func.__name__: _wrap_plugin_function("function", func, config)
+                for func in plugin.globals()
+            }
+        )
 
     if hasattr(plugin, "functions"):
-        env.globals.update({func.__name__: func for func in plugin.functions()})
+        env.globals.update(
+            {
+                func.__name__: _wrap_plugin_function("function", func, config)
+                for func in plugin.functions()
+            }
+        )
 
     if hasattr(plugin, "data"):
         env.globals.update(plugin.data())
@@ -402,10 +1451,20 @@ def load_plugin(
         load_extensions(env, plugin.extensions())
 
     if hasattr(plugin, "filters"):
-        env.filters.update({func.__name__: func for func in plugin.filters()})
+        env.filters.update(
+            {
+                func.__name__: _wrap_plugin_function("filter", func, config)
+                for func in plugin.filters()
+            }
+        )
 
     if hasattr(plugin, "tests"):
-        env.tests.update({func.__name__: func for func in plugin.tests()})
+        env.tests.update(
+            {
+                func.__name__: _wrap_plugin_function("test", func, config)
+                for func in plugin.tests()
+            }
+        )
 
     if hasattr(plugin, "policies"):
         env.policies.update(plugin.policies())
@@ -413,14 +1472,26 @@ def load_plugin(
     return plugin
 
 
-def render_dir(input: Path, output: Path, config: Config) -> None:
+def render_dir(
+    input: Path, output: Path, config: Config, dry_run: bool = False
+) -> bool:
+    """Create the output dir unless it exists and return whether it has been created."""
     if output.exists() and not config.force:
         log(f"Skip existing dir '{output}'", config)
-    else:
-        log(f"Create dir '{input}' -> '{output}'", config)
 
+        return False
+
+    log(f"Create dir '{input}' -> '{output}'", config)
+
+    if not dry_run:
         output.mkdir(exist_ok=True)
 
+    return True
+
+
+def is_template(input: Path, config: Config, enforce_jinja_suffix: bool) -> bool:
+    return input.suffix == config.jinja_suffix or not enforce_jinja_suffix
+
 
 def render_file(
     input: Path,
@@ -428,30 +1499,242 @@ def render_file(
     output: Path,
     config: Config,
     env: Environment,
+    data_loaders: abc.Mapping[str, DataLoader],
     enforce_jinja_suffix: bool,
-) -> None:
-    if output.exists() and not config.force and output != STDOUT_PATH:
+    overwrite: bool = False,
+) -> Outcome:
+    if skip_existing(output, config, overwrite):
+        return Outcome.skipped
+
+    elif is_template(input, config, enforce_jinja_suffix):
+        template, file_data = load_template(template_name, config, env, data_loaders)
+
+        if config.stream:
+            # Rendering and writing are interleaved
+            with phase("render"):
+                return stream_template(template, file_data, input, output, config)
+
+        with phase("render"):
+            rendered = template.render(file_data)
+
+        return write_rendered(rendered, input, output, config)
+
+    else:
+        return copy_static(input, output, config)
+
+
+async def render_file_async(
+    input: Path,
+    template_name: str,
+    output: Path,
+    config: Config,
+    env: Environment,
+    data_loaders: abc.Mapping[str, DataLoader],
+    enforce_jinja_suffix: bool,
+    overwrite: bool = False,
+) -> Outcome:
+    """Like `render_file`, but the template is rendered on the event loop and files are written in a thread."""
+    import asyncio
+
+    if skip_existing(output, config, overwrite):
+        return Outcome.skipped
+
+    elif is_template(input, config, enforce_jinja_suffix):
+        template, file_data = load_template(template_name, config, env, data_loaders)
+
+        with phase("render"):
+            rendered = await template.render_async(file_data)
+
+        return await asyncio.to_thread(write_rendered, rendered, input, output, config)
+
+    else:
+        return await asyncio.to_thread(copy_static, input, output, config)
+
+
+def skip_existing(output: Path, config: Config, overwrite: bool) -> bool:
+    if output.exists() and not (config.force or overwrite) and output != STDOUT_PATH:
         log(f"Skip existing file '{output}'", config)
 
-    elif input.suffix == config.jinja_suffix or not enforce_jinja_suffix:
+        return True
+
+    return False
+
+
+def load_template(
+    template_name: str,
+    config: Config,
+    env: Environment,
+    data_loaders: abc.Mapping[str, DataLoader],
+) -> tuple[Template, dict[str, Any]]:
+    with phase("load"):
         template = env.get_template(template_name)
-        file_data = load_file_data(template_name, config)
-        rendered = template.render(file_data)
 
-        # Write the rendered template if it has content
-        # Prevents empty macro definitions
-        if rendered.strip() == "" and not config.keep_empty:
-            log(f"Skip empty file '{input}'", config)
+    with phase("data"):
+        file_data = load_file_data(template_name, config, data_loaders)
+
+    return template, file_data
+
+
+def write_rendered(rendered: str, input: Path, output: Path, config: Config) -> Outcome:
+    # Write the rendered template if it has content
+    # Prevents empty macro definitions
+    if rendered.strip() == "" and not config.keep_empty:
+        log(f"Skip empty file '{input}'", config)
+
+        return Outcome.empty
+
+    elif config.write_if_changed and output != STDOUT_PATH:
+        # Text mode would translate the newlines when writing
+        content = rendered.replace("\n", os.linesep).encode(ENCODING)
+
+        if file_has_content(output, content):
+            log(f"Skip unchanged file '{output}'", config)
+
+            return Outcome.unchanged
+
+    log(f"Render file '{input}' -> '{output}'", config)
+
+    with phase("write"), output.open("w") as fp:
+        fp.write(rendered)
+
+    if config.copy_metadata:
+        shutil.copystat(input, output)
+
+    return Outcome.rendered
+
+
+def copy_static(input: Path, output: Path, config: Config) -> Outcome:
+    if (
+        config.write_if_changed
+        and output.exists()
+        and filecmp.cmp(input, output, shallow=False)
+    ):
+        log(f"Skip unchanged file '{output}'", config)
+
+        return Outcome.unchanged
+
+    elif output == STDOUT_PATH:
+        log(f"Copy file '{input}' -> '{output}'", config)
+
+        shutil.copyfile(input, output)
+
+        return Outcome.copied
+
+    else:
+        with phase("write"):
+            copy_mode = copy_file(input, output, config.copy_mode)
+        log(f"{COPY_MESSAGES[copy_mode]} file '{input}' -> '{output}'", config)
+
+        return COPY_OUTCOMES[copy_mode]
+
+
+def stream_template(
+    template: Template,
+    file_data: Data,
+    input: Path,
+    output: Path,
+    config: Config,
+) -> Outcome:
+    """Write the rendered template chunk by chunk without keeping the whole document in memory."""
+    chunks = template.generate(file_data)
+    leading_chunks: list[str] = []
+
+    # Only leading whitespace needs to be buffered to detect empty templates
+    if not config.keep_empty:
+        for chunk in chunks:
+            leading_chunks.append(chunk)
+
+            if chunk.strip():
+                break
         else:
-            log(f"Render file '{input}' -> '{output}'", config)
+            log(f"Skip empty file '{input}'", config)
 
-            with output.open("w") as fp:
-                fp.write(rendered)
+            return Outcome.empty
 
-            if config.copy_metadata:
-                shutil.copystat(input, output)
+    chunks = itertools.chain(leading_chunks, chunks)
 
+    if config.write_if_changed and output != STDOUT_PATH and output.is_file():
+        if not write_changed_chunks(output, chunks):
+            log(f"Skip unchanged file '{output}'", config)
+
+            return Outcome.unchanged
     else:
-        log(f"Copy file '{input}' -> '{output}'", config)
+        with output.open("w", buffering=STREAM_BUFFER_SIZE) as fp:
+            fp.writelines(chunks)
+
+    log(f"Render file '{input}' -> '{output}'", config)
+
+    if config.copy_metadata:
+        shutil.copystat(input, output)
+
+    return Outcome.rendered
+
+
+def write_changed_chunks(path: Path, chunks: abc.Iterable[str]) -> bool:
+    """Compare the chunks with the existing file and only overwrite it starting at the first difference.
+
+    Returns `True` if the file has been modified.
+    """
+    encoder = codecs.getincrementalencoder(ENCODING)()
+    position = 0
+    changed = False
+
+    with path.open("r+b", buffering=STREAM_BUFFER_SIZE) as fp:
+        for chunk in itertools.chain(chunks, [None]):
+            # Text mode would translate the newlines when writing
+            if chunk is None:
+                content = encoder.encode("", final=True)
+            else:
+                content = encoder.encode(chunk.replace("\n", os.linesep))
+
+            if not changed:
+                if fp.read(len(content)) == content:
+                    position += len(content)
+                    continue
+
+                changed = True
+                fp.seek(position)
+
+            fp.write(content)
+
+        if changed:
+            fp.truncate()
+        elif fp.read(1):
+            # The existing file is longer than the rendered template
+            changed = True
+            fp.truncate(position)
+
+    return changed
+
+
+def file_has_content(path: Path, content: bytes) -> bool:
+    """Check if the file at `path` contains exactly `content` without reading it at once."""
+    try:
+        if path.stat().st_size != len(content):
+            return False
+
+        with path.open("rb") as fp:
+            view = memoryview(content)
+
+            for offset in range(0, len(content), COMPARE_CHUNK_SIZE):
+                chunk = view[offset : offset + COMPARE_CHUNK_SIZE]
+
+                if fp.read(len(chunk)) != chunk:
+                    return False
+    except FileNotFoundError:
+        return False
+
+    return True
+
+
+def _wrap_plugin_function(
+    kind: str, func: abc.Callable[..., Any], config: Config
+) -> abc.Callable[..., Any]:
+    """Apply the memoization declared with `makejinja.plugin.cached` and the profiling."""
+    if options := getattr(func, "makejinja_cache", None):
+        func = memoize(func, options)
+
+    if config.profile or config.profile_output is not None:
+        return profiled(f"{kind} {func.__name__}", func)
 
-        shutil.copy2(input, output)
+    return func
@@ -0,0 +1,231 @@
+"""Render many jobs in a single resident process.
+
+Each job is a JSON object with the options of a run, named as in `makejinja.toml`
+(e.g., `{"inputs": ["templates"], "output": "build", "data_vars": {"env": "prod"}}`).
+Options not given by a job are loaded from `makejinja.toml` and environment variables like in a regular run.
+The optional key `cwd` sets the working directory of a job, which relative paths are resolved against.
+
+Jobs are either read as JSON lines from a file (`--batch`) or sent to a server listening on a Unix socket (`--serve`).
+The server replies with one JSON line per job containing its log messages and error (if any),
+so any tool able to write to a Unix socket can act as a client (e.g., `socat`), not only `--connect`.
+Compiled templates are shared between all jobs using the same Jinja settings, so every template is only compiled once.
+"""
+
+import json
+import os
+import socket
+import socketserver
+import stat
+import subprocess
+import sys
+import threading
+from collections import abc
+from pathlib import Path
+from typing import Any
+
+import rich_click as click
+import typed_settings as ts
+from typed_settings.exceptions import TsError
+from typed_settings.loaders import DictLoader, Loader
+
+from makejinja.app import capture_log, input_errors, makejinja
+from makejinja.cache import share_bytecode_caches
+from makejinja.config import Config
+
+__all__ = ["connect", "run_batch", "serve"]
+
+
+def run_job(job: abc.Mapping[str, Any], loaders: abc.Sequence[Loader]) -> None:
+    options = dict(job)
+    cwd = options.pop("cwd", None)
+    previous_cwd = os.getcwd()
+    previous_path = sys.path.copy()
+    previous_modules = set(sys.modules)
+
+    try:
+        if cwd is not None:
+            os.chdir(cwd)
+
+        config = ts.load_settings(Config, [*loaders, DictLoader(options)])
+        # Like a regular invocation (e.g., only planning the run)
+        makejinja(config)
+    finally:
+        os.chdir(previous_cwd)
+        # Jobs may use different plugins with the same module name from their import paths
+        _unload_modules(
+            set(sys.modules) - previous_modules, sys.path[len(previous_path) :]
+        )
+        sys.path[:] = previous_path
+
+
+def _unload_modules(names: abc.Iterable[str], import_paths: abc.Sequence[str]) -> None:
+    for name in names:
+        file = getattr(sys.modules[name], "__file__", None)
+
+        if file is not None and any(
+            Path(file).is_relative_to(path) for path in import_paths
+        ):
+            del sys.modules[name]
+
+
+def job_errors() -> tuple[type[Exception], ...]:
+    """Errors that only fail a single job (e.g., invalid options or plugins that cannot be imported)."""
+    return (
+        *input_errors(),
+        ImportError,
+        subprocess.SubprocessError,
+        TsError,
+        click.ClickException,
+    )
+
+
+def describe_error(error: BaseException) -> str:
+    if isinstance(error, ExceptionGroup):
+        return "; ".join(describe_error(e) for e in error.exceptions)
+
+    return str(error) or type(error).__name__
+
+
+def _parse_jobs(lines: abc.Iterable[str]) -> abc.Iterator[dict[str, Any] | Exception]:
+    for line in lines:
+        if not line.strip():
+            continue
+
+        try:
+            job = json.loads(line)
+        except ValueError as e:
+            yield e
+        else:
+            yield (
+                job if isinstance(job, dict) else ValueError("A job must be an object")
+            )
+
+
+def run_batch(lines: abc.Iterable[str], loaders: abc.Sequence[Loader]) -> bool:
+    """Run the jobs given as JSON lines one after another and return whether all of them succeeded."""
+    success = True
+
+    with share_bytecode_caches():
+        for number, job in enumerate(_parse_jobs(lines), start=1):
+            try:
+                if isinstance(job, Exception):
+                    raise job
+
+                run_job(job, loaders)
+            except job_errors() as e:
+                success = False
+                click.echo(f"Job {number} failed: {describe_error(e)}", err=True)
+
+    return success
+
+
+class _JobHandler(socketserver.StreamRequestHandler):
+    server: "_JobServer"
+
+    def handle(self) -> None:
+        lines = (line.decode("utf-8") for line in self.rfile)
+
+        for job in _parse_jobs(lines):
+            error: str | None = None
+
+            with capture_log() as messages:
+                try:
+                    if isinstance(job, Exception):
+                        raise job
+
+                    run_job(job, self.server.loaders)
+                except job_errors() as e:
+                    error = describe_error(e)
+
+            response = {"ok": error is None, "log": messages, "error": error}
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class _JobServer(socketserver.UnixStreamServer):
+    def __init__(self, path: Path, loaders: abc.Sequence[Loader]) -> None:
+        self.loaders = loaders
+        super().__init__(str(path), _JobHandler)
+
+    def server_bind(self) -> None:
+        super().server_bind()
+        # Jobs may run arbitrary commands (e.g., `exec-pre`), so only the owner may connect
+        os.chmod(self.server_address, 0o600)
+
+
+def serve(path: Path, loaders: abc.Sequence[Loader]) -> None:
+    """Accept jobs on the Unix socket `path` until interrupted.
+
+    Connections are handled one after another, so jobs never run concurrently.
+    """
+    # A socket left behind by a previous server would prevent binding to it
+    if path.exists() and stat.S_ISSOCK(path.stat().st_mode) and not _is_listening(path):
+        path.unlink()
+
+    with share_bytecode_caches(), _JobServer(path, loaders) as server:
+        click.echo(f"Listening for jobs on '{path}'", err=True)
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            path.unlink(missing_ok=True)
+
+
+def _is_listening(path: Path) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(path))
+        except OSError:
+            return False
+
+    return True
+
+
+def connect(path: Path, lines: abc.Iterable[str]) -> bool:
+    """Send the jobs given as JSON lines to the server listening on `path` and return whether all of them succeeded.
+
+    Jobs without a working directory are run in the current one.
+    """
+    cwd = os.getcwd()
+    success = True
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(path))
+
+        def send() -> None:
+            for line in lines:
+                if not line.strip():
+                    continue
+
+                try:
+                    job = json.loads(line)
+                    job.setdefault("cwd", cwd)
+                    line = json.dumps(job)
+                except (ValueError, AttributeError):
+                    # Invalid jobs are reported by the server to keep the numbering
+                    pass
+
+                sock.sendall(line.rstrip("\n").encode("utf-8") + b"\n")
+
+            sock.shutdown(socket.SHUT_WR)
+
+        # Sending in the background prevents a deadlock if the server replies faster than we send
+        sender = threading.Thread(target=send, daemon=True)
+        sender.start()
+
+        with sock.makefile("r", encoding="utf-8") as fp:
+            for number, line in enumerate(fp, start=1):
+                response = json.loads(line)
+
+                for message in response["log"]:
+                    click.echo(message, err=True)
+
+                if not response["ok"]:
+                    success = False
+                    click.echo(f"Job {number} failed: {response['error']}", err=True)
+
+        sender.join()
+
+    return success
@@ -0,0 +1,577 @@
+"""Persistent caches that speed up repeated invocations of makejinja."""
+
+import fnmatch
+import functools
+import hashlib
+import importlib
+import inspect
+import marshal
+import os
+import pickle
+import sys
+import tempfile
+import time
+from collections import OrderedDict, abc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any
+
+import jinja2
+from jinja2.bccache import Bucket, FileSystemBytecodeCache
+from jinja2.bccache import BytecodeCache as BaseBytecodeCache
+
+from makejinja.config import Config
+from makejinja.plugin import CacheOptions
+
+__all__ = ["BytecodeCache", "DataCache", "MemoryBytecodeCache", "memoize"]
+
+# Maximum number of compiled templates kept in memory per set of Jinja settings
+MEMORY_BYTECODE_ENTRIES = 10_000
+
+# E.g., lambdas, local functions, or open files
+PICKLING_ERRORS = (pickle.PicklingError, TypeError, AttributeError)
+# E.g., truncated or corrupted files, or entries referencing classes that no longer exist
+UNPICKLING_ERRORS = (
+    OSError,
+    EOFError,
+    ValueError,
+    TypeError,
+    AttributeError,
+    ImportError,
+    pickle.UnpicklingError,
+)
+
+_shared_bytecode_caches: ContextVar[
+    dict[tuple[str, Path | None], "MemoryBytecodeCache"] | None
+] = ContextVar("shared_bytecode_caches", default=None)
+
+
+def prune_directory(directory: Path, pattern: str, max_size: int) -> int:
+    """Remove the least recently used files matching `pattern` until their total size is at most `max_size`.
+
+    Returns the total size of the remaining files.
+    """
+    entries: list[tuple[int, int, str]] = []
+    total_size = 0
+
+    with os.scandir(directory) as it:
+        for entry in it:
+            if fnmatch.fnmatch(entry.name, pattern):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                total_size += stat.st_size
+
+    if total_size > max_size:
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+            total_size -= size
+
+            if total_size <= max_size:
+                break
+
+    return total_size
+
+
+class BytecodeCache(FileSystemBytecodeCache):
+    """Store compiled templates on disk so that subsequent runs can skip lexing, parsing, and compiling.
+
+    Jinja already invalidates entries if the template source changes.
+    In addition, the file names contain a fingerprint of all settings affecting the generated code
+    (e.g., delimiters, prefixes, whitespace handling, and extensions),
+    so changing them never reuses stale code.
+    Once the cache exceeds `max_size` bytes, the least recently used entries are evicted.
+    """
+
+    def __init__(self, directory: Path, fingerprint: str, max_size: int) -> None:
+        directory.mkdir(parents=True, exist_ok=True)
+        super().__init__(str(directory), f"__makejinja_{fingerprint}_%s.cache")
+
+        self.max_size = max_size
+        self._all_pattern = "__makejinja_*.cache"
+        self._size = prune_directory(directory, self._all_pattern, max_size)
+
+    def load_bytecode(self, bucket: Bucket) -> None:
+        super().load_bytecode(bucket)
+
+        if bucket.code is not None:
+            # The modification time tracks the last usage for the eviction
+            try:
+                os.utime(self._get_cache_filename(bucket))
+            except OSError:
+                pass
+
+    def dump_bytecode(self, bucket: Bucket) -> None:
+        super().dump_bytecode(bucket)
+
+        try:
+            self._size += os.path.getsize(self._get_cache_filename(bucket))
+        except OSError:
+            return
+
+        if self._size > self.max_size:
+            self._size = prune_directory(
+                Path(self.directory), self._all_pattern, self.max_size
+            )
+
+
+def bytecode_fingerprint(config: Config) -> str:
+    settings = (
+        config.delimiter,
+        config.prefix,
+        config.whitespace,
+        config.internal.optimized,
+        config.internal.autoescape,
+        config.internal.enable_async,
+        config.extensions,
+        config.plugins,
+        config.loaders,
+        jinja2.__version__,
+        sys.version_info[:2],
+    )
+
+    return hashlib.sha256(repr(settings).encode()).hexdigest()[:16]
+
+
+class MemoryBytecodeCache(BaseBytecodeCache):
+    """Keep compiled templates in memory so that later runs in the same process skip compiling them.
+
+    Entries are only reused if the template source is unchanged.
+    Misses are looked up in the persistent `fallback` cache (if any), and new entries are written to it as well.
+    """
+
+    def __init__(
+        self,
+        fallback: BytecodeCache | None = None,
+        max_entries: int = MEMORY_BYTECODE_ENTRIES,
+    ) -> None:
+        self.fallback = fallback
+        self.max_entries = max_entries
+        # Key: bucket key, Value: source checksum and code object
+        self._entries: OrderedDict[str, tuple[str, Any]] = OrderedDict()
+
+    def load_bytecode(self, bucket: Bucket) -> None:
+        entry = self._entries.get(bucket.key)
+
+        if entry is not None and entry[0] == bucket.checksum:
+            self._entries.move_to_end(bucket.key)
+            bucket.code = entry[1]
+        elif self.fallback is not None:
+            self.fallback.load_bytecode(bucket)
+
+            if bucket.code is not None:
+                self._store(bucket)
+
+    def dump_bytecode(self, bucket: Bucket) -> None:
+        self._store(bucket)
+
+        if self.fallback is not None:
+            self.fallback.dump_bytecode(bucket)
+
+    def _store(self, bucket: Bucket) -> None:
+        self._entries[bucket.key] = (bucket.checksum, bucket.code)
+        self._entries.move_to_end(bucket.key)
+
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+@contextmanager
+def share_bytecode_caches() -> abc.Iterator[None]:
+    """Share compiled templates between all runs in this context that use the same Jinja settings."""
+    token = _shared_bytecode_caches.set({})
+
+    try:
+        yield
+    finally:
+        _shared_bytecode_caches.reset(token)
+
+
+def init_bytecode_cache(config: Config) -> BaseBytecodeCache | None:
+    directory = config.internal.bytecode_cache
+    shared_caches = _shared_bytecode_caches.get()
+
+    if shared_caches is None:
+        return _init_persistent_bytecode_cache(config)
+
+    key = (bytecode_fingerprint(config), directory)
+
+    if (cache := shared_caches.get(key)) is None:
+        cache = MemoryBytecodeCache(_init_persistent_bytecode_cache(config))
+        shared_caches[key] = cache
+
+    return cache
+
+
+def _init_persistent_bytecode_cache(config: Config) -> BytecodeCache | None:
+    if config.internal.bytecode_cache is None:
+        return None
+
+    return BytecodeCache(
+        config.internal.bytecode_cache,
+        bytecode_fingerprint(config),
+        config.internal.bytecode_cache_size,
+    )
+
+
+def default_cache_dir() -> Path | None:
+    if cache_home := os.environ.get("XDG_CACHE_HOME"):
+        return Path(cache_home, "makejinja")
+
+    try:
+        return Path.home() / ".cache" / "makejinja"
+    except RuntimeError:
+        # Neither `HOME` nor a user database entry is available (e.g., in some containers)
+        return None
+
+
+class DataCache:
+    """Store parsed data files on disk so that subsequent runs can skip parsing them.
+
+    Entries are looked up by the path of the data file and the code of the loader parsing it (including the parser version).
+    They are reused if the size and modification time of the file are unchanged.
+    Otherwise, the content hash is compared so that touching a file (e.g., during a checkout) does not invalidate it.
+    Once the cache exceeds `max_size` bytes, the least recently used entries are evicted.
+    """
+
+    pattern = "__makejinja_data_*.pickle"
+
+    def __init__(self, directory: Path, max_size: int) -> None:
+        directory.mkdir(parents=True, exist_ok=True)
+
+        self.directory = directory
+        self.max_size = max_size
+        self._size = prune_directory(directory, self.pattern, max_size)
+
+    def load(
+        self, path: Path, loader: abc.Callable[[Path], dict[str, Any]]
+    ) -> dict[str, Any]:
+        """Return the parsed contents of `path`, only calling `loader` if the cache is stale."""
+        cache_file = self._cache_filename(path, loader)
+        stat = path.stat()
+        content_hash: str | None = None
+
+        try:
+            with cache_file.open("rb") as fp:
+                size, mtime_ns, cached_hash, data = pickle.load(fp)
+        except UNPICKLING_ERRORS:
+            # Missing, corrupted, or incompatible entries are simply replaced
+            pass
+        else:
+            if size == stat.st_size and mtime_ns == stat.st_mtime_ns:
+                self._touch(cache_file)
+                return data
+
+            content_hash = _hash_file(path)
+
+            if cached_hash == content_hash:
+                self._dump(cache_file, stat, content_hash, data)
+                return data
+
+        data = loader(path)
+        self._dump(cache_file, stat, content_hash or _hash_file(path), data)
+
+        return data
+
+    def is_fresh(
+        self, path: Path, loader: abc.Callable[[Path], dict[str, Any]]
+    ) -> bool:
+        """Cheaply check (without reading the entry) whether `load` will most likely not call `loader`."""
+        try:
+            cache_mtime = self._cache_filename(path, loader).stat().st_mtime_ns
+        except OSError:
+            return False
+
+        return cache_mtime >= path.stat().st_mtime_ns
+
+    def _cache_filename(
+        self, path: Path, loader: abc.Callable[[Path], dict[str, Any]]
+    ) -> Path:
+        key = (str(path.resolve()), _loader_identity(loader))
+        digest = hashlib.sha256(repr(key).encode()).hexdigest()[:32]
+
+        return self.directory / f"__makejinja_data_{digest}.pickle"
+
+    def _touch(self, cache_file: Path) -> None:
+        # The modification time tracks the last usage for the eviction
+        try:
+            os.utime(cache_file)
+        except OSError:
+            pass
+
+    def _dump(
+        self, cache_file: Path, stat: os.stat_result, content_hash: str, data: Any
+    ) -> None:
+        try:
+            payload = pickle.dumps(
+                (stat.st_size, stat.st_mtime_ns, content_hash, data),
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        except PICKLING_ERRORS:
+            # Data containing objects that cannot be pickled is not cached
+            return
+
+        try:
+            # Write atomically since parallel runs may access the same entry
+            fd, tmp_name = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(payload)
+
+            os.replace(tmp_name, cache_file)
+        except OSError:
+            return
+
+        self._size += len(payload)
+
+        if self._size > self.max_size:
+            self._size = prune_directory(self.directory, self.pattern, self.max_size)
+
+
+def _loader_identity(loader: abc.Callable[[Path], dict[str, Any]]) -> str:
+    """Identify a data loader by its code, so that changing it invalidates its entries."""
+    try:
+        return _cached_loader_identity(loader)
+    except TypeError:
+        # Unhashable callables
+        return _compute_loader_identity(loader)
+
+
+def _compute_loader_identity(loader: abc.Callable[[Path], dict[str, Any]]) -> str:
+    identity = _function_identity(loader)
+
+    # The built-in loaders delegate to parsers whose output may change between versions
+    if getattr(loader, "__module__", None) == "makejinja.app" and (
+        parser := _BUILTIN_LOADER_PARSERS.get(loader.__qualname__)
+    ):
+        identity += f"-{_module_version(parser)}"
+
+    return identity
+
+
+_cached_loader_identity = functools.cache(_compute_loader_identity)
+
+# Key: name of a built-in data loader, Value: module of the third-party parser it uses
+_BUILTIN_LOADER_PARSERS = {"from_yaml": "yaml", "from_json": "orjson"}
+
+
+def _module_version(name: str) -> str | None:
+    # Looking up the package metadata instead would be much slower than importing the parser
+    try:
+        module = importlib.import_module(name)
+    except ImportError:
+        return None
+
+    return getattr(module, "__version__", None)
+
+
+def _hash_file(path: Path) -> str:
+    with path.open("rb") as fp:
+        return hashlib.file_digest(fp, "sha256").hexdigest()
+
+
+def init_data_cache(config: Config) -> DataCache | None:
+    if not config.internal.data_cache:
+        return None
+
+    directory = config.internal.data_cache_dir
+
+    if directory is None:
+        if (cache_dir := default_cache_dir()) is None:
+            return None
+
+        directory = cache_dir / "data"
+
+    return _data_cache(directory, config.internal.data_cache_size)
+
+
+@functools.cache
+def _data_cache(directory: Path, max_size: int) -> DataCache | None:
+    try:
+        return DataCache(directory, max_size)
+    except OSError:
+        # E.g., the cache directory is not writable
+        return None
+
+
+_MISSING = object()
+FUNCTION_CACHE_SIZE = 100 * 1024 * 1024
+
+
+class FunctionCache:
+    """Results of a function in memory (bounded, least recently used ones first) and optionally on disk."""
+
+    pattern = "__makejinja_function_*.pickle"
+
+    def __init__(
+        self,
+        func: abc.Callable[..., Any],
+        options: CacheOptions,
+        directory: Path | None,
+    ) -> None:
+        self.options = options
+        # Key: arguments, Value: expiry time and result
+        self.entries: OrderedDict[Any, tuple[float, Any]] = OrderedDict()
+        self.directory: Path | None = None
+
+        # Without a directory, results are only kept in memory
+        if options.persist and directory is not None:
+            try:
+                directory.mkdir(parents=True, exist_ok=True)
+            except OSError:
+                pass
+            else:
+                self.directory = directory
+                self._prefix = _function_identity(func)
+                prune_directory(directory, self.pattern, FUNCTION_CACHE_SIZE)
+
+    def get(self, key: Any) -> Any:
+        entry = self.entries.get(key)
+
+        if entry is None and self.directory is not None:
+            entry = self._load(key)
+
+        if entry is None:
+            return _MISSING
+
+        expires, value = entry
+
+        if expires < self._now():
+            self.entries.pop(key, None)
+            return _MISSING
+
+        self._remember(key, entry)
+
+        return value
+
+    def set(self, key: Any, value: Any) -> None:
+        ttl = self.options.ttl
+        entry = (self._now() + ttl if ttl is not None else float("inf"), value)
+        self._remember(key, entry)
+
+        if self.directory is not None:
+            self._dump(key, entry)
+
+    def _now(self) -> float:
+        # Persistent entries need an expiry time that is valid across runs
+        return time.monotonic() if self.directory is None else time.time()
+
+    def _remember(self, key: Any, entry: tuple[float, Any]) -> None:
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+
+        if (
+            self.options.maxsize is not None
+            and len(self.entries) > self.options.maxsize
+        ):
+            self.entries.popitem(last=False)
+
+    def _cache_filename(self, key: Any) -> Path | None:
+        assert self.directory is not None
+
+        try:
+            digest = hashlib.sha256(pickle.dumps(key)).hexdigest()[:32]
+        except PICKLING_ERRORS:
+            return None
+
+        return self.directory / f"__makejinja_function_{self._prefix}_{digest}.pickle"
+
+    def _load(self, key: Any) -> tuple[float, Any] | None:
+        if (cache_file := self._cache_filename(key)) is None:
+            return None
+
+        try:
+            with cache_file.open("rb") as fp:
+                return pickle.load(fp)
+        except UNPICKLING_ERRORS:
+            return None
+
+    def _dump(self, key: Any, entry: tuple[float, Any]) -> None:
+        assert self.directory is not None
+
+        if (cache_file := self._cache_filename(key)) is None:
+            return
+
+        try:
+            payload = pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL)
+            fd, tmp_name = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(payload)
+
+            os.replace(tmp_name, cache_file)
+        except (*PICKLING_ERRORS, OSError):
+            return
+
+
+def _function_identity(func: abc.Callable[..., Any]) -> str:
+    """Hash the name and code of a function, so that persisted results are invalidated if it changes."""
+    func = inspect.unwrap(getattr(func, "__func__", func))
+    code = getattr(func, "__code__", None)
+    identity = (
+        getattr(func, "__module__", None),
+        getattr(func, "__qualname__", repr(func)),
+        marshal.dumps(code) if code is not None else None,
+        sys.version_info[:2],
+    )
+
+    return hashlib.sha256(repr(identity).encode()).hexdigest()[:16]
+
+
+def memoize(
+    func: abc.Callable[..., Any], options: CacheOptions
+) -> abc.Callable[..., Any]:
+    """Wrap a function declared with `makejinja.plugin.cached`.
+
+    Calls with unhashable arguments (e.g., lists or dictionaries) are not cached.
+    """
+    cache_dir = default_cache_dir()
+    cache = FunctionCache(
+        func, options, None if cache_dir is None else cache_dir / "functions"
+    )
+
+    def make_key(args: tuple[Any, ...], kwargs: dict[str, Any]) -> Any:
+        key = (args, tuple(sorted(kwargs.items())))
+
+        try:
+            hash(key)
+        except TypeError:
+            return None
+
+        return key
+
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+            if (key := make_key(args, kwargs)) is None:
+                return await func(*args, **kwargs)
+
+            if (value := cache.get(key)) is _MISSING:
+                value = await func(*args, **kwargs)
+                cache.set(key, value)
+
+            return value
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        if (key := make_key(args, kwargs)) is None:
+            return func(*args, **kwargs)
+
+        if (value := cache.get(key)) is _MISSING:
+            value = func(*args, **kwargs)
+            cache.set(key, value)
+
+        return value
+
+    return wrapper
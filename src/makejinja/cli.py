@@ -3,14 +3,13 @@
 """
 
 from pathlib import Path
+from typing import Any
 
 import rich_click as click
 import typed_settings as ts
 
 from makejinja.config import OPTION_GROUPS, Config
 
-from .app import makejinja
-
 __all__: list[str] = []
 
 click.rich_click.USE_MARKDOWN = True
@@ -21,10 +20,84 @@ _ts_loaders = ts.default_loaders(
 )
 
 
+# The batch modes read the options of their jobs themselves,
+# so they are handled before the (possibly required) options of a single run are validated
+def _batch_callback(ctx: click.Context, param: click.Parameter, value: Any) -> None:
+    if value is None or ctx.resilient_parsing:
+        return
+
+    from .batch import run_batch
+
+    ctx.exit(0 if run_batch(value, _ts_loaders) else 1)
+
+
+def _serve_callback(ctx: click.Context, param: click.Parameter, value: Any) -> None:
+    if value is None or ctx.resilient_parsing:
+        return
+
+    from .batch import serve
+
+    serve(value, _ts_loaders)
+    ctx.exit()
+
+
+def _connect_callback(ctx: click.Context, param: click.Parameter, value: Any) -> None:
+    if value is None or ctx.resilient_parsing:
+        return
+
+    from .batch import connect
+
+    ctx.exit(0 if connect(value, click.get_text_stream("stdin")) else 1)
+
+
 @click.command("makejinja", context_settings={"help_option_names": ("--help", "-h")})
 @click.version_option(None, "--version", "-v")
+@click.option(
+    "--watch",
+    "-w",
+    is_flag=True,
+    help="""
+        Keep running after rendering and re-render the affected outputs whenever
+        a file in `inputs`, `data`, or `file-data` changes.
+    """,
+)
+@click.option(
+    "--batch",
+    type=click.File("r"),
+    is_eager=True,
+    expose_value=False,
+    callback=_batch_callback,
+    help="""
+        Read jobs as JSON lines from the given file (`-` for stdin) and render all of them in a single process.
+        Each job is an object with the options of a run named as in `makejinja.toml`
+        (e.g., `{"inputs": ["templates"], "output": "build"}`), all other options are ignored.
+        Templates are only compiled once for all jobs with the same Jinja settings.
+    """,
+)
+@click.option(
+    "--serve",
+    type=click.Path(dir_okay=False, path_type=Path),
+    is_eager=True,
+    expose_value=False,
+    callback=_serve_callback,
+    help="""
+        Keep running and accept jobs (like `--batch`) on the given Unix socket.
+        For every job, a JSON line with its log messages and error (if any) is sent back.
+    """,
+)
+@click.option(
+    "--connect",
+    type=click.Path(dir_okay=False, path_type=Path),
+    is_eager=True,
+    expose_value=False,
+    callback=_connect_callback,
+    help="""
+        Send the jobs read as JSON lines from stdin to the server listening on the given Unix socket (see `--serve`).
+        Jobs are run in the current working directory unless they set `cwd`.
+    """,
+)
 @ts.click_options(Config, _ts_loaders)
-def makejinja_cli(config: Config):
+def makejinja_cli(config: Config, watch: bool):
     """makejinja can be used to automatically generate files from [Jinja templates](https://jinja.palletsprojects.com/en/3.1.x/templates/).
 
     Instead of passing CLI options, you can also write them to a file called `makejinja.toml` in your working directory.
@@ -34,7 +107,15 @@ def makejinja_cli(config: Config):
     To override its location, you can set the environment variable `MAKEJINJA_SETTINGS` to the path of your config file.
     """
 
-    makejinja(config)
+    # Imported here so that `--help` and `--version` do not need to load the renderer
+    if watch:
+        from .watch import watch as makejinja_watch
+
+        makejinja_watch(config)
+    else:
+        from .app import makejinja
+
+        makejinja(config)
 
 
 if __name__ == "__main__":
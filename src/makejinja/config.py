@@ -1,39 +1,79 @@
 from collections import abc
 from enum import Enum
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 import rich_click as click
 import typed_settings as ts
 from frozendict import frozendict
-from jinja2 import (
-    ChainableUndefined,
-    DebugUndefined,
-    StrictUndefined,
-)
-from jinja2 import Undefined as DefaultUndefined
-from jinja2.defaults import (
-    BLOCK_END_STRING,
-    BLOCK_START_STRING,
-    COMMENT_END_STRING,
-    COMMENT_START_STRING,
-    LINE_COMMENT_PREFIX,
-    LINE_STATEMENT_PREFIX,
-    NEWLINE_SEQUENCE,
-    VARIABLE_END_STRING,
-    VARIABLE_START_STRING,
-)
 from rich_click.utils import OptionGroupDict
 
-__all__ = ["Config", "Delimiter", "Internal", "Prefix", "Whitespace", "Undefined"]
+if TYPE_CHECKING:
+    import jinja2
+
+__all__ = [
+    "Config",
+    "CopyMode",
+    "Delimiter",
+    "Internal",
+    "MergeStrategy",
+    "Prefix",
+    "ProfileFormat",
+    "Undefined",
+    "Whitespace",
+]
+
+
+# The defaults of Jinja (see `jinja2.defaults`), repeated here so that the CLI starts without importing Jinja
+BLOCK_START_STRING = "{%"
+BLOCK_END_STRING = "%}"
+VARIABLE_START_STRING = "{{"
+VARIABLE_END_STRING = "}}"
+COMMENT_START_STRING = "{#"
+COMMENT_END_STRING = "#}"
+LINE_STATEMENT_PREFIX: str | None = None
+LINE_COMMENT_PREFIX: str | None = None
+NEWLINE_SEQUENCE = "\n"
 
 
 class Undefined(Enum):
     """How to handle undefined variables."""
 
-    default = DefaultUndefined
-    chainable = ChainableUndefined
-    debug = DebugUndefined
-    strict = StrictUndefined
+    # Names of the classes in `jinja2`, which are only imported when creating the environment
+    default = "Undefined"
+    chainable = "ChainableUndefined"
+    debug = "DebugUndefined"
+    strict = "StrictUndefined"
+
+    @property
+    def jinja_class(self) -> type["jinja2.Undefined"]:
+        import jinja2
+
+        return getattr(jinja2, self.value)
+
+
+class CopyMode(Enum):
+    """How to transfer files that are not templates to the output."""
+
+    copy = "copy"
+    reflink = "reflink"
+    hardlink = "hardlink"
+    symlink = "symlink"
+
+
+class MergeStrategy(Enum):
+    """How to combine the variables of multiple data files."""
+
+    shallow = "shallow"
+    deep = "deep"
+    append = "append"
+
+
+class ProfileFormat(Enum):
+    """File format of exported profiles."""
+
+    json = "json"
+    chrome = "chrome"
 
 
 def _exclude_patterns_validator(instance, attribute, value) -> None:
@@ -45,6 +85,36 @@ def _exclude_patterns_validator(instance, attribute, value) -> None:
         )
 
 
+def parse_shard(value: str) -> tuple[int, int]:
+    """Parse `K/N` into the (1-based) index of a shard and the number of shards."""
+    index, separator, count = value.partition("/")
+
+    try:
+        shard = int(index), int(count)
+    except ValueError:
+        shard = (0, 0)
+
+    if not separator or not 1 <= shard[0] <= shard[1]:
+        raise ValueError(f"Invalid shard '{value}', expected 'K/N' with 1 <= K <= N.")
+
+    return shard
+
+
+def _shard_validator(instance, attribute, value) -> None:
+    if value is not None:
+        parse_shard(value)
+
+
+def _shard_callback(ctx: click.Context, param: click.Parameter, value: str | None):
+    # Report invalid values like other invalid options instead of failing when loading the config
+    try:
+        _shard_validator(None, None, value)
+    except ValueError as e:
+        raise click.BadParameter(str(e)) from None
+
+    return value
+
+
 @ts.settings(frozen=True)
 class Delimiter:
     block_start: str = ts.option(
@@ -132,6 +202,73 @@ class Internal:
         click={"param_decls": "--internal-enable-async", "hidden": True},
         help="""
             If set to true this enables async template execution which allows using async functions and generators.
+            Unless multiple `jobs` are used, templates are then rendered concurrently on an event loop
+            (written in threads and without streaming), so that slow async plugins do not block each other.
+        """,
+    )
+    async_concurrency: int = ts.option(
+        default=32,
+        click={"param_decls": "--internal-async-concurrency", "hidden": True},
+        help="""
+            Maximum number of templates rendered concurrently if `enable-async` is set.
+        """,
+    )
+    bytecode_cache: Path | None = ts.option(
+        default=None,
+        click={
+            "type": click.Path(file_okay=False, path_type=Path),
+            "param_decls": "--bytecode-cache",
+        },
+        help="""
+            Directory where compiled templates are stored to speed up subsequent runs.
+            The cache is invalidated automatically if a template or a setting affecting the compilation
+            (e.g., delimiters, prefixes, whitespace handling, or extensions) changes.
+            If not given, templates are compiled on every run.
+        """,
+    )
+    bytecode_cache_size: int = ts.option(
+        default=100 * 1024 * 1024,
+        click={"param_decls": "--bytecode-cache-size", "hidden": True},
+        help="""
+            Maximum size of the bytecode cache in bytes.
+            If exceeded, the least recently used templates are evicted.
+        """,
+    )
+
+    data_cache: bool = ts.option(
+        default=True,
+        click={"param_decls": "--data-cache/--no-data-cache"},
+        help="""
+            Store parsed data files on disk to speed up subsequent runs.
+            Entries are invalidated automatically if the size, modification time, or content of a data file changes.
+        """,
+    )
+    data_cache_dir: Path | None = ts.option(
+        default=None,
+        click={
+            "type": click.Path(file_okay=False, path_type=Path),
+            "param_decls": "--data-cache-dir",
+            "hidden": True,
+        },
+        help="""
+            Directory of the data cache.
+            Defaults to `$XDG_CACHE_HOME/makejinja/data` or `~/.cache/makejinja/data`.
+        """,
+    )
+    data_cache_size: int = ts.option(
+        default=100 * 1024 * 1024,
+        click={"param_decls": "--data-cache-size", "hidden": True},
+        help="""
+            Maximum size of the data cache in bytes.
+            If exceeded, the least recently used data files are evicted.
+        """,
+    )
+    data_jobs_threshold: int = ts.option(
+        default=128,
+        click={"param_decls": "--internal-data-jobs-threshold", "hidden": True},
+        help="""
+            Minimum number of data files that need to be parsed before they are distributed among the worker processes (see `jobs`).
+            Smaller data sets are parsed serially since starting the workers would take longer.
         """,
     )
 
@@ -212,6 +349,8 @@ class Config:
         help="""
             Glob patterns pattern to exclude files matched.
             Applied against files discovered through `include_patterns` via `Path.match`.
+            Excluded directories are not searched.
+            In addition, a `.makejinjaignore` file in an input directory may list patterns with the semantics of `.gitignore` files.
             **Note:** The recursive wildcard `**` is not supported (it acts like non-recursive `*`).
             Multiple can be provided.
         """,
@@ -263,6 +402,34 @@ class Config:
                 If multiple files are supplied, beware that previous declarations will be overwritten by newer ones.
             """,
     )
+    namespace_data: bool = ts.option(
+        default=False,
+        click={"param_decls": "--namespace-data"},
+        help="""
+            Store the variables of every data file under a key derived from its path relative to the given `data` directory
+            (e.g., `data/foo/bar.yaml` is available as `foo.bar`) instead of merging all files.
+        """,
+    )
+    lazy_data: bool = ts.option(
+        default=False,
+        click={"param_decls": "--lazy-data"},
+        help="""
+            Only parse data files once a template accesses their variables.
+            Combined with `namespace-data`, every file is parsed individually on first access.
+            Otherwise, all files are parsed as soon as a template uses any variable not defined elsewhere.
+        """,
+    )
+    data_merge: MergeStrategy = ts.option(
+        default=MergeStrategy.shallow,
+        click={"param_decls": "--data-merge"},
+        help="""
+            How to combine the variables of multiple data files (and `data-var` with them).
+            `shallow` replaces top-level variables defined in a previous file,
+            `deep` recursively merges nested mappings,
+            and `append` additionally concatenates lists instead of replacing them.
+            Unchanged nested values are shared instead of copied, so merging stays fast for large data sets.
+        """,
+    )
     data_vars: abc.Mapping[str, str] = ts.option(
         default=frozendict(),
         click={
@@ -276,6 +443,18 @@ class Config:
             """,
         },
     )
+    data_loaders: abc.Mapping[str, str] = ts.option(
+        default=frozendict(),
+        click={
+            "param_decls": ("--data-loader",),
+            "help": """
+                Parse data files with the given suffix (e.g., `.csv=your.custom:load_csv`) using a custom function.
+                The function receives the path of the data file and has to return a dictionary.
+                These loaders take precedence over the built-in ones and those registered by plugins.
+                **Note:** This option may be passed multiple times.
+            """,
+        },
+    )
     file_data: abc.Mapping[str, tuple[Path, ...]] = ts.option(
         default=frozendict(),
         click={
@@ -371,6 +550,94 @@ class Config:
             Whether to overwrite existing files in the output directory.
         """,
     )
+    copy_mode: CopyMode = ts.option(
+        default=CopyMode.copy,
+        help="""
+            How to transfer files that are not templates to the output.
+            `copy` duplicates the content (using `copy_file_range` or `sendfile` if supported),
+            `reflink` creates a copy-on-write clone on filesystems supporting it (e.g., Btrfs or XFS),
+            `hardlink` and `symlink` create links to the input file.
+            If the filesystem does not support the selected mode, the file is copied instead.
+            **Note:** Modifying hard-linked outputs also modifies the inputs.
+        """,
+    )
+    write_if_changed: bool = ts.option(
+        default=False,
+        click={"param_decls": "--write-if-changed"},
+        help="""
+            When overwriting existing files, leave them untouched if their content would not change.
+            This preserves their modification time and avoids triggering downstream rebuilds.
+        """,
+    )
+    stream: bool = ts.option(
+        default=False,
+        click={"param_decls": "--stream"},
+        help="""
+            Write rendered templates to their output files chunk by chunk instead of rendering them in memory first.
+            This keeps the memory usage low for very large outputs.
+            **Note:** If rendering fails, the output file may be incomplete.
+        """,
+    )
+    shard: str | None = ts.option(
+        default=None,
+        click={"param_decls": "--shard", "callback": _shard_callback},
+        validator=_shard_validator,
+        help="""
+            Only render the `K`-th of `N` parts of the files found in `inputs` (given as `K/N`, e.g., `2/4`),
+            so that large builds can be split across multiple machines.
+            The parts are balanced by the durations recorded in `shard-manifest` and by the file sizes otherwise,
+            so all shards have to be run with the same inputs and `shard-manifest`.
+            Every shard needs its own `output`; in incremental builds (see `incremental`), it only re-renders its own outdated files.
+            Empty dirs are not removed and dir metadata is not copied; use `merge-shard` to do so after combining the shards.
+        """,
+    )
+    shard_manifest: Path | None = ts.option(
+        default=None,
+        click={
+            "type": click.Path(dir_okay=False, path_type=Path),
+            "param_decls": "--shard-manifest",
+        },
+        help="""
+            Manifest shared by all shards (see `shard`), e.g., the one written by `merge-shard` in the previous incremental build.
+            Files recorded in it stay on the shard that rendered them if the number of shards is unchanged,
+            and new files are balanced by the recorded durations.
+            If it does not exist, all files are balanced by their sizes.
+        """,
+    )
+    merge_shards: tuple[Path, ...] = ts.option(
+        default=(),
+        click={
+            "type": click.Path(exists=True, file_okay=False, path_type=Path),
+            "param_decls": "--merge-shard",
+        },
+        help="""
+            Instead of rendering, combine the outputs of shard runs (see `shard`) into `output`.
+            Their manifests are merged, stale outputs are removed,
+            and empty dirs as well as dir metadata are handled once for the combined output.
+            **Note:** This option may be passed multiple times to pass a list of values.
+        """,
+    )
+    plan: bool = ts.option(
+        default=False,
+        click={"param_decls": "--plan"},
+        help="""
+            Only print which files would be rendered, copied, skipped, or removed instead of running.
+            For incremental builds, every file is checked against the manifest,
+            and the duration recorded by the last run is shown as its estimated cost.
+            Shell hooks are not executed and data files are only loaded if required by plugins.
+        """,
+    )
+    incremental: bool = ts.option(
+        default=False,
+        click={"param_decls": "--incremental"},
+        help="""
+            Only render the templates whose dependencies changed since the last run.
+            To do so, a manifest is stored in the output directory that records the source,
+            the included/imported/extended templates, and the data of every rendered file.
+            Outputs whose source no longer exists are removed.
+            Existing files not recorded in the manifest are handled as usual (see `force`).
+        """,
+    )
     quiet: bool = ts.option(
         default=False,
         click={"param_decls": ("--quiet", "-q")},
@@ -378,6 +645,52 @@ class Config:
             Print no information about the rendering process.
         """,
     )
+    verbose: bool = ts.option(
+        default=False,
+        click={"param_decls": "--verbose"},
+        help="""
+            Print additional details about the rendering process (e.g., which parser loaded a data file and how long it took).
+        """,
+    )
+    jobs: int = ts.option(
+        default=1,
+        click={"param_decls": ("--jobs", "-j")},
+        help="""
+            Number of worker processes used to render the templates found in `inputs`
+            and to parse the files in `data` (if there are many of them).
+            Each worker builds its own Jinja environment (including plugins) from this config.
+            If set to `0`, one worker per CPU core is used.
+            Log messages are always printed in the same order as with a single worker.
+        """,
+    )
+    profile: bool = ts.option(
+        default=False,
+        click={"param_decls": "--profile"},
+        help="""
+            Measure the time spent loading, rendering, and writing every template
+            as well as the calls of all filters, functions, and tests registered by plugins.
+            A summary of the slowest ones is printed after rendering.
+        """,
+    )
+    profile_output: Path | None = ts.option(
+        default=None,
+        click={
+            "type": click.Path(dir_okay=False, path_type=Path),
+            "param_decls": "--profile-output",
+        },
+        help="""
+            File to export the complete profile to.
+            Profiling is enabled automatically, but the summary is only printed if `profile` is set.
+        """,
+    )
+    profile_format: ProfileFormat = ts.option(
+        default=ProfileFormat.json,
+        help="""
+            Format of `profile-output`.
+            `json` contains the totals per template and plugin function,
+            `chrome` contains a timeline in the trace event format (viewable in Perfetto or `chrome://tracing`).
+        """,
+    )
     delimiter: Delimiter = Delimiter()
     prefix: Prefix = Prefix()
     whitespace: Whitespace = Whitespace()
@@ -397,6 +710,8 @@ OPTION_GROUPS: dict[str, list[OptionGroupDict]] = {
                 "--keep-jinja-suffix",
                 "--keep-empty",
                 "--copy-metadata",
+                "--write-if-changed",
+                "--incremental",
             ],
         },
         {
@@ -404,7 +719,11 @@ OPTION_GROUPS: dict[str, list[OptionGroupDict]] = {
             "options": [
                 "--data",
                 "--data-var",
+                "--data-loader",
                 "--file-data",
+                "--namespace-data",
+                "--lazy-data",
+                "--data-merge",
                 "--plugin",
                 "--import-path",
                 "--extension",
@@ -438,6 +757,31 @@ OPTION_GROUPS: dict[str, list[OptionGroupDict]] = {
                 "--prefix-line-comment",
             ],
         },
+        {
+            "name": "Modes",
+            "options": [
+                "--watch",
+                "--plan",
+                "--shard",
+                "--shard-manifest",
+                "--merge-shard",
+                "--batch",
+                "--serve",
+                "--connect",
+            ],
+        },
+        {
+            "name": "Performance",
+            "options": [
+                "--jobs",
+                "--bytecode-cache",
+                "--data-cache",
+                "--stream",
+                "--profile",
+                "--profile-output",
+                "--profile-format",
+            ],
+        },
         {
             "name": "Shell Hooks",
             "options": [
@@ -0,0 +1,140 @@
+"""Strategies to transfer non-template files from the inputs to the output.
+
+Every strategy falls back to a regular copy if the filesystem does not support it
+(e.g., hard links across devices or reflinks on filesystems without copy-on-write).
+Regular copies are delegated to the kernel via `copy_file_range` or `sendfile` on Linux
+and only fall back to reading and writing the file in user space if both are unsupported.
+"""
+
+import errno
+import os
+import shutil
+import sys
+from collections import abc
+from pathlib import Path
+from typing import Any
+
+from makejinja.config import CopyMode
+
+__all__ = ["copy_file"]
+
+# From linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+# Maximum number of bytes transferred per system call
+CHUNK_SIZE = 1024 * 1024 * 1024
+# Like in `shutil`: on other platforms (e.g., macOS and the BSDs), the destination of `sendfile` must be a socket
+_USE_SENDFILE = hasattr(os, "sendfile") and sys.platform.startswith("linux")
+
+# Errors signaling that an operation is not supported for the given files
+_UNSUPPORTED = {
+    errno.EXDEV,
+    errno.ENOSYS,
+    errno.EINVAL,
+    errno.EOPNOTSUPP,
+    errno.ENOTSUP,
+    errno.ENOTTY,
+    errno.EBADF,
+    errno.EPERM,
+    errno.EMLINK,
+}
+
+
+def copy_file(input: Path, output: Path, mode: CopyMode) -> CopyMode:
+    """Transfer `input` to `output` using the given mode or a fallback.
+
+    An existing output is replaced (and never written through, even if it is a link to the input).
+    Returns the mode that has actually been used.
+    """
+    output.unlink(missing_ok=True)
+
+    if mode is CopyMode.symlink and _try(os.symlink, os.path.abspath(input), output):
+        return CopyMode.symlink
+
+    if mode is CopyMode.hardlink and _try(os.link, input, output):
+        return CopyMode.hardlink
+
+    with input.open("rb") as src, output.open("wb") as dst:
+        if mode is CopyMode.reflink and _try(_clone, src.fileno(), dst.fileno()):
+            used_mode = CopyMode.reflink
+        else:
+            _copy_data(src.fileno(), dst.fileno(), os.fstat(src.fileno()).st_size)
+            used_mode = CopyMode.copy
+
+    shutil.copystat(input, output)
+
+    return used_mode
+
+
+def _try(func: abc.Callable[..., object], *args: Any) -> bool:
+    try:
+        func(*args)
+    except NotImplementedError:
+        return False
+    except OSError as e:
+        if e.errno in _UNSUPPORTED:
+            return False
+
+        raise
+
+    return True
+
+
+def _clone(src_fd: int, dst_fd: int) -> None:
+    try:
+        import fcntl
+    except ImportError:
+        raise NotImplementedError from None
+
+    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+
+
+def _copy_data(src_fd: int, dst_fd: int, size: int) -> None:
+    copied = 0
+
+    if hasattr(os, "copy_file_range"):
+        copied = _copy_range(_copy_file_range, src_fd, dst_fd, size, copied)
+
+    if copied < size and _USE_SENDFILE:
+        os.lseek(dst_fd, copied, os.SEEK_SET)
+        copied = _copy_range(_sendfile, src_fd, dst_fd, size, copied)
+
+    if copied < size:
+        os.lseek(src_fd, copied, os.SEEK_SET)
+        os.lseek(dst_fd, copied, os.SEEK_SET)
+
+        while chunk := os.read(src_fd, shutil.COPY_BUFSIZE):
+            os.write(dst_fd, chunk)
+
+
+def _copy_range(
+    func: abc.Callable[[int, int, int, int], int],
+    src_fd: int,
+    dst_fd: int,
+    size: int,
+    copied: int,
+) -> int:
+    """Call `func` until the file has been copied or the operation turns out to be unsupported."""
+    while copied < size:
+        try:
+            sent = func(src_fd, dst_fd, min(size - copied, CHUNK_SIZE), copied)
+        except OSError as e:
+            if e.errno in _UNSUPPORTED:
+                return copied
+
+            raise
+
+        # The file has been truncated while copying it
+        if sent == 0:
+            return size
+
+        copied += sent
+
+    return copied
+
+
+def _sendfile(src_fd: int, dst_fd: int, count: int, offset: int) -> int:
+    return os.sendfile(dst_fd, src_fd, offset, count)
+
+
+def _copy_file_range(src_fd: int, dst_fd: int, count: int, offset: int) -> int:
+    return os.copy_file_range(src_fd, dst_fd, count, offset, offset)
@@ -0,0 +1,214 @@
+"""Persistent record of rendered outputs and their dependencies for incremental rebuilds.
+
+The manifest is stored as JSON in the output directory.
+Every output (relative to the output directory) maps to an entry describing where it came from:
+
+- Rendered templates store the template closure (the template itself and all templates it includes, imports, or extends) and the file-specific data.
+- Copied files store the hash of their source.
+
+Data files, data variables, plugins, and Jinja settings apply to all templates and are thus stored once as the manifest context.
+If the context changes, all outputs are considered to be stale.
+"""
+
+import hashlib
+import inspect
+import json
+from collections import abc
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from jinja2 import Environment, TemplateNotFound, meta
+from jinja2.utils import import_string
+
+from makejinja.config import Config
+
+__all__ = ["Manifest"]
+
+MANIFEST_NAME = ".makejinja-manifest.json"
+MANIFEST_VERSION = 1
+
+Entry = dict[str, Any]
+
+
+@dataclass(slots=True)
+class Manifest:
+    context: dict[str, Any] = field(default_factory=dict)
+    outputs: dict[str, Entry] = field(default_factory=dict)
+
+    @classmethod
+    def load(cls, path: Path) -> "Manifest":
+        """Read the manifest from `path`, returning an empty one if it is missing or outdated."""
+        try:
+            with path.open("rb") as fp:
+                obj = json.load(fp)
+        except (OSError, ValueError):
+            return cls()
+
+        if not isinstance(obj, abc.Mapping) or obj.get("version") != MANIFEST_VERSION:
+            return cls()
+
+        return cls(obj.get("context", {}), obj.get("outputs", {}))
+
+    def dump(self, path: Path) -> None:
+        obj = {
+            "version": MANIFEST_VERSION,
+            "context": self.context,
+            "outputs": dict(sorted(self.outputs.items())),
+        }
+
+        with path.open("w") as fp:
+            json.dump(obj, fp, indent=2)
+
+
+def hash_bytes(value: bytes) -> str:
+    return hashlib.sha256(value).hexdigest()
+
+
+def hash_file(path: Path) -> str | None:
+    try:
+        with path.open("rb") as fp:
+            return hashlib.file_digest(fp, "sha256").hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def manifest_context(
+    config: Config, data_paths: abc.Iterable[Path], plugins: abc.Iterable[str]
+) -> dict[str, Any]:
+    """Describe everything that affects all outputs at once."""
+    # Caching and concurrency settings do not change the outputs, so they are left out
+    settings = (
+        config.delimiter,
+        config.prefix,
+        config.whitespace,
+        config.internal.optimized,
+        config.internal.autoescape,
+        config.internal.enable_async,
+        config.undefined,
+        config.extensions,
+        config.jinja_suffix,
+        config.keep_jinja_suffix,
+        config.keep_empty,
+        config.copy_metadata,
+        config.namespace_data,
+        config.data_merge,
+        config.copy_mode,
+    )
+
+    return {
+        "settings": hash_bytes(repr(settings).encode()),
+        "data": {str(path): hash_file(path) for path in data_paths},
+        "data_vars": hash_bytes(
+            json.dumps(dict(config.data_vars), sort_keys=True).encode()
+        ),
+        "data_loaders": dict(config.data_loaders),
+        "plugins": {name: _plugin_identity(name) for name in plugins},
+    }
+
+
+def _plugin_identity(plugin_name: str) -> str | None:
+    """Hash the source file of the module defining a plugin."""
+    try:
+        source_file = inspect.getsourcefile(import_string(plugin_name))
+    except (ImportError, TypeError):
+        return None
+
+    return hash_file(Path(source_file)) if source_file else None
+
+
+def template_entry(
+    source: Path, template_name: str, config: Config, env: Environment
+) -> Entry:
+    return {
+        "source": str(source),
+        "templates": template_closure(template_name, env),
+        "file_data": file_data_hashes(template_name, config),
+    }
+
+
+def copy_entry(source: Path) -> Entry:
+    return {"source": str(source), "hash": hash_file(source)}
+
+
+def template_closure(
+    template_name: str, env: Environment
+) -> dict[str, dict[str, str | None]] | None:
+    """Collect the template and all templates it (transitively) includes, imports, or extends.
+
+    Returns `None` if a referenced template name is only known at render time.
+    """
+    templates: dict[str, dict[str, str | None]] = {}
+    pending = [template_name]
+
+    while pending:
+        name = pending.pop()
+
+        if name in templates:
+            continue
+
+        try:
+            source, state = _template_state(name, env)
+        except TemplateNotFound:
+            # Optional includes (`ignore missing`) become stale once the template exists
+            templates[name] = {"path": None, "hash": None}
+            continue
+
+        templates[name] = state
+
+        for reference in meta.find_referenced_templates(env.parse(source, name)):
+            if reference is None:
+                return None
+
+            pending.append(reference)
+
+    return templates
+
+
+def _template_state(name: str, env: Environment) -> tuple[str, dict[str, str | None]]:
+    assert env.loader is not None
+    source, filename, _ = env.loader.get_source(env, name)
+
+    return source, {"path": filename, "hash": hash_bytes(source.encode())}
+
+
+def file_data_hashes(template_name: str, config: Config) -> dict[str, str | None]:
+    return {
+        str(path): hash_file(path) for path in config.file_data.get(template_name, ())
+    }
+
+
+def is_up_to_date(
+    entry: Entry,
+    source: Path,
+    template_name: str,
+    output: Path,
+    is_template: bool,
+    config: Config,
+    env: Environment,
+) -> bool:
+    """Check whether none of the dependencies recorded for an output have changed."""
+    if entry.get("source") != str(source):
+        return False
+
+    if not entry.get("empty") and not output.exists():
+        return False
+
+    if not is_template:
+        return "hash" in entry and entry["hash"] == hash_file(source)
+
+    templates = entry.get("templates")
+
+    if templates is None:
+        return False
+
+    for name, recorded in templates.items():
+        try:
+            _, state = _template_state(name, env)
+        except TemplateNotFound:
+            state = {"path": None, "hash": None}
+
+        if state != recorded:
+            return False
+
+    return entry.get("file_data") == file_data_hashes(template_name, config)
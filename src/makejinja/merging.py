@@ -0,0 +1,94 @@
+"""Combine the variables of data files without copying or modifying them.
+
+Parsed data files are shared (e.g., between runs in watch mode or via the data cache), so they must never be modified.
+Instead of deep-copying them, the merged data references their nested values as long as they are unchanged.
+Only the mappings (and lists) along the paths that are actually modified are copied, each of them at most once:
+the copies are owned by the merger and modified in place by all later merges.
+Thus, merging many files takes time roughly linear in their total size.
+"""
+
+from collections import abc
+from typing import Any
+
+from makejinja.config import MergeStrategy
+
+__all__ = ["DataMerger"]
+
+
+class DataMerger:
+    """Merge data into a target mapping owned by the caller according to a strategy."""
+
+    __slots__ = ("_owned", "strategy")
+
+    def __init__(self, strategy: MergeStrategy = MergeStrategy.shallow) -> None:
+        self.strategy = strategy
+        # Key: id of a container created by the merger, Value: the container
+        # Keeping a reference ensures that the id is not reused by another object
+        self._owned: dict[int, Any] = {}
+
+    def merge(
+        self, target: abc.MutableMapping[str, Any], source: abc.Mapping[str, Any]
+    ) -> None:
+        """Merge `source` into `target`, which is modified in place."""
+        if self.strategy is MergeStrategy.shallow:
+            target.update(source)
+            return
+
+        for key, value in source.items():
+            self._assign(target, key, value)
+
+    def set(
+        self,
+        target: abc.MutableMapping[str, Any],
+        keys: abc.Sequence[str],
+        value: Any,
+    ) -> None:
+        """Merge `value` into `target` at the nested path `keys`, creating missing mappings along the way."""
+        here = target
+
+        for key in keys[:-1]:
+            child = here.get(key)
+            child = (
+                self._own_mapping(child)
+                if isinstance(child, abc.Mapping)
+                else self._new({})
+            )
+            here[key] = child
+            here = child
+
+        if self.strategy is MergeStrategy.shallow:
+            here[keys[-1]] = value
+        else:
+            self._assign(here, keys[-1], value)
+
+    def _assign(
+        self, target: abc.MutableMapping[str, Any], key: str, value: Any
+    ) -> None:
+        current = target.get(key)
+
+        if isinstance(current, abc.Mapping) and isinstance(value, abc.Mapping):
+            merged = target[key] = self._own_mapping(current)
+            self.merge(merged, value)
+        elif (
+            self.strategy is MergeStrategy.append
+            and isinstance(current, list)
+            and isinstance(value, list)
+        ):
+            if id(current) in self._owned:
+                current.extend(value)
+            else:
+                target[key] = self._new([*current, *value])
+        else:
+            # The value is referenced, not copied
+            target[key] = value
+
+    def _own_mapping(self, mapping: abc.Mapping[str, Any]) -> dict[str, Any]:
+        if id(mapping) in self._owned:
+            return mapping  # type: ignore[return-value]
+
+        # Copying a mapping only copies references to its values (which stay shared)
+        return self._new(dict(mapping))
+
+    def _new(self, container: Any) -> Any:
+        self._owned[id(container)] = container
+        return container
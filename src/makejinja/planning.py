@@ -0,0 +1,195 @@
+"""Show what a run would do without rendering or writing anything.
+
+The inputs are walked by the same code as in a regular run (without rendering or creating anything),
+and every output is checked against the manifest of the last incremental build (if any).
+Data files are only parsed if a plugin accesses them while being set up.
+The estimated cost of an output is the duration of rendering (or copying) it recorded in the manifest.
+"""
+
+import sys
+from collections import Counter, abc
+from dataclasses import dataclass
+from enum import Enum
+from pathlib import Path
+
+import typed_settings as ts
+
+from makejinja.app import (
+    STDIN_PATH,
+    STDOUT_PATH,
+    PathStep,
+    RenderTask,
+    collect_data_loaders,
+    collect_files,
+    collect_path_filters,
+    emit,
+    init_jinja_env,
+    is_inside_output,
+    is_template,
+    load_data,
+    load_plugins,
+    walk_inputs,
+)
+from makejinja.config import Config
+from makejinja.manifest import (
+    MANIFEST_NAME,
+    Manifest,
+    is_up_to_date,
+    manifest_context,
+)
+
+__all__ = ["Action", "PlannedStep", "plan", "print_plan"]
+
+
+class Action(Enum):
+    render = "render"
+    copy = "copy"
+    create = "create"
+    skip = "skip"
+    up_to_date = "up-to-date"
+    remove = "remove"
+
+
+@dataclass(slots=True, frozen=True)
+class PlannedStep:
+    action: Action
+    path: Path
+    output: Path | None = None
+    reason: str | None = None
+    # Estimated duration in seconds (if recorded by a previous run)
+    cost: float | None = None
+
+
+def plan(config: Config) -> list[PlannedStep]:
+    """Determine the steps of a run in the order they would be executed."""
+    for path in config.import_paths:
+        sys.path.append(str(path.resolve()))
+
+    # Parsing the data is only needed if plugins use it while being set up
+    # and templates from stdin must not be consumed
+    lazy_config = ts.evolve(
+        config,
+        lazy_data=True,
+        inputs=tuple(path for path in config.inputs if path != STDIN_PATH),
+    )
+    data_loaders = collect_data_loaders(lazy_config)
+    data = load_data(lazy_config, data_loaders)
+    env = init_jinja_env(lazy_config, data)
+    plugin_path_filters = collect_path_filters(load_plugins(env, data, lazy_config))
+
+    manifest_path = config.output / MANIFEST_NAME
+    previous_manifest = Manifest.load(manifest_path)
+    # Cleaning the output also removes the manifest
+    incremental = config.incremental and not config.clean
+    same_context = incremental and previous_manifest.context == manifest_context(
+        config, collect_files(config.data), (*config.plugins, *config.loaders)
+    )
+
+    steps: list[PlannedStep] = []
+    tasks: list[RenderTask] = []
+
+    if config.clean and config.output.is_dir():
+        steps.append(PlannedStep(Action.remove, config.output, reason="clean"))
+
+    # The same walk as in a regular run, but without rendering or creating anything
+    walk_steps, _ = walk_inputs(
+        config, env, plugin_path_filters, data_loaders, dry_run=True
+    )
+
+    # Like in a regular run, only the tasks of this shard are considered (see `run`)
+    if config.shard is not None:
+        from makejinja.sharding import select_shard
+
+        walk_steps = select_shard(walk_steps, config)
+
+    for walk_step in walk_steps:
+        if isinstance(walk_step, RenderTask):
+            tasks.append(walk_step)
+        elif not isinstance(walk_step, PathStep):
+            continue
+        elif walk_step.excluded:
+            steps.append(PlannedStep(Action.skip, walk_step.path, reason="excluded"))
+        # Cleaning the output removes all existing dirs
+        elif walk_step.created or config.clean:
+            steps.append(PlannedStep(Action.create, walk_step.path, walk_step.output))
+
+    current_keys: set[str] = set()
+
+    for task in tasks:
+        input_path, output_path = task.input, task.output
+        template = is_template(input_path, config, task.enforce_jinja_suffix)
+        entry = None
+
+        if output_path.is_relative_to(config.output):
+            key = output_path.relative_to(config.output).as_posix()
+            current_keys.add(key)
+            entry = previous_manifest.outputs.get(key)
+
+        cost = entry.get("duration") if entry is not None else None
+        exists = (
+            not config.clean and output_path.exists() and output_path != STDOUT_PATH
+        )
+
+        if (
+            same_context
+            and entry is not None
+            and is_up_to_date(
+                entry,
+                input_path,
+                task.template_name,
+                output_path,
+                template,
+                config,
+                env,
+            )
+        ):
+            step = PlannedStep(Action.up_to_date, input_path, output_path)
+        elif exists and not config.force and not (incremental and entry is not None):
+            step = PlannedStep(Action.skip, input_path, output_path, "exists")
+        else:
+            action = Action.render if template else Action.copy
+            step = PlannedStep(action, input_path, output_path, cost=cost)
+
+        steps.append(step)
+
+    if incremental:
+        steps.extend(
+            PlannedStep(Action.remove, config.output / key, reason="stale")
+            for key in sorted(previous_manifest.outputs.keys() - current_keys)
+            if is_inside_output(config.output / key, config)
+            and (config.output / key).is_file()
+        )
+
+    return steps
+
+
+def print_plan(steps: abc.Sequence[PlannedStep]) -> None:
+    """Print every step and a summary including the estimated duration of all renders and copies."""
+    for step in steps:
+        line = f"{step.action.value:<11} {step.path}"
+
+        if step.output is not None:
+            line += f" -> {step.output}"
+
+        if step.reason is not None:
+            line += f" ({step.reason})"
+
+        if step.cost is not None:
+            line += f" [{step.cost * 1000:.1f} ms]"
+
+        emit(line, err=False)
+
+    counts = Counter(step.action for step in steps)
+    work = [step for step in steps if step.action in (Action.render, Action.copy)]
+    estimated = sum(step.cost for step in work if step.cost is not None)
+    unknown = sum(step.cost is None for step in work)
+
+    summary = ", ".join(
+        f"{counts[action]} {action.value}" for action in Action if counts[action]
+    )
+    emit(f"Plan: {summary or 'nothing to do'}", err=False)
+    emit(
+        f"Estimated duration: {estimated:.3f} s"
+        + (f" (not recorded for {unknown} file(s))" if unknown else ""),
+        err=False,
+    )
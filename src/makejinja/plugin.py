@@ -1,13 +1,14 @@
 from collections import abc
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Protocol
+from typing import Any, Protocol, TypeVar
 
 from jinja2 import Environment
 from jinja2.ext import Extension
 
 from makejinja.config import Config
 
-__all__ = ["Plugin"]
+__all__ = ["Plugin", "cached"]
 
 Extensions = abc.Sequence[type[Extension]]
 Filter = abc.Callable[[Any], Any]
@@ -21,6 +22,50 @@ MutableData = abc.MutableMapping[str, Any]
 Data = abc.Mapping[str, Any]
 PathFilter = abc.Callable[[Path], bool]
 PathFilters = abc.Sequence[PathFilter]
+F = TypeVar("F", bound=abc.Callable[..., Any])
+DataLoader = abc.Callable[[Path], dict[str, Any]]
+DataLoaders = abc.Mapping[str, DataLoader]
+
+
+@dataclass(slots=True, frozen=True)
+class CacheOptions:
+    maxsize: int | None
+    ttl: float | None
+    persist: bool
+
+
+def cached(
+    func: F | None = None,
+    *,
+    maxsize: int | None = 1024,
+    ttl: float | None = None,
+    persist: bool = False,
+) -> Any:
+    """Memoize a function, filter, or test returned by a plugin.
+
+    Calls with the same (hashable) arguments return the stored result instead of calling the function again.
+    At most `maxsize` results are kept (least recently used ones are evicted, `None` means unbounded)
+    and they expire after `ttl` seconds (`None` means never).
+    With `persist`, results are also stored in the user's cache directory and reused by subsequent runs
+    until the code of the function changes, so arguments and results must be picklable.
+
+    Only pure functions should be cached. Can be used with or without arguments:
+
+        @cached
+        def resolve(name): ...
+
+        @cached(ttl=60, persist=True)
+        def lookup(key): ...
+    """
+
+    def decorator(func: F) -> F:
+        func.makejinja_cache = CacheOptions(maxsize, ttl, persist)  # type: ignore[attr-defined]
+        return func
+
+    if func is not None:
+        return decorator(func)
+
+    return decorator
 
 
 class Plugin(Protocol):
@@ -50,6 +95,11 @@ class Plugin(Protocol):
     def path_filters(self) -> PathFilters:
         return []
 
+    # Data is loaded before plugins are initialized, so loaders are registered by the class
+    @classmethod
+    def data_loaders(cls) -> DataLoaders:
+        return {}
+
     # Deprecated: Use functions() and data() instead
     def globals(self) -> Functions:
         return []
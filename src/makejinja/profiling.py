@@ -0,0 +1,225 @@
+"""Measure where the time of a run is spent.
+
+Every rendered file gets a `TaskProfile` holding the duration of its phases (loading/compiling the template,
+loading its file-specific data, rendering, and writing) and of the plugin functions called while rendering it.
+The profiles are part of the render results, so they are also collected from worker processes.
+"""
+
+import functools
+import inspect
+import json
+import os
+import time
+from collections import abc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, TypeVar
+
+from makejinja.config import ProfileFormat
+
+__all__ = ["Stopwatch", "TaskProfile", "format_profile", "write_profile"]
+
+PHASES = ("load", "data", "render", "write")
+
+T = TypeVar("T", bound=abc.Callable[..., Any])
+
+_current_profile: ContextVar["TaskProfile | None"] = ContextVar(
+    "current_profile", default=None
+)
+
+
+@dataclass(slots=True)
+class TaskProfile:
+    name: str
+    pid: int
+    start: int
+    end: int = 0
+    # Phase name, start, and duration (in nanoseconds)
+    spans: list[tuple[str, int, int]] = field(default_factory=list)
+    # Key: plugin function, Value: number of calls and cumulative duration (in nanoseconds)
+    calls: dict[str, list[int]] = field(default_factory=dict)
+
+    def duration(self, phase: str | None = None) -> int:
+        if phase is None:
+            return self.end - self.start
+
+        return sum(duration for name, _, duration in self.spans if name == phase)
+
+
+@contextmanager
+def profile_task(name: str) -> abc.Iterator[TaskProfile]:
+    """Record the phases and plugin calls of the code executed in this context."""
+    profile = TaskProfile(name, os.getpid(), time.perf_counter_ns())
+    token = _current_profile.set(profile)
+
+    try:
+        yield profile
+    finally:
+        profile.end = time.perf_counter_ns()
+        _current_profile.reset(token)
+
+
+class phase:
+    """Attribute the time spent in this context to a phase of the current profile (if any)."""
+
+    __slots__ = ("name", "profile", "start")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.profile: TaskProfile | None = None
+        self.start = 0
+
+    def __enter__(self) -> None:
+        self.profile = _current_profile.get()
+
+        if self.profile is not None:
+            self.start = time.perf_counter_ns()
+
+    def __exit__(self, *exc_info: object) -> None:
+        if self.profile is not None:
+            self.profile.spans.append(
+                (self.name, self.start, time.perf_counter_ns() - self.start)
+            )
+
+
+def profiled(name: str, func: T) -> T:
+    """Count the calls and cumulative duration of `func` for the current profile."""
+    # Timing a coroutine function would only measure the creation of the coroutine
+    if inspect.iscoroutinefunction(func):
+        return func
+
+    # `functools.wraps` keeps attributes like `jinja_pass_arg` set by `pass_context`
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        profile = _current_profile.get()
+
+        if profile is None:
+            return func(*args, **kwargs)
+
+        start = time.perf_counter_ns()
+
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stats = profile.calls.setdefault(name, [0, 0])
+            stats[0] += 1
+            stats[1] += time.perf_counter_ns() - start
+
+    return wrapper  # type: ignore[return-value]
+
+
+class Stopwatch:
+    """Measure the durations (in seconds) of consecutive stages of a run."""
+
+    __slots__ = ("_last", "laps")
+
+    def __init__(self) -> None:
+        self.laps: dict[str, float] = {}
+        self._last = time.perf_counter()
+
+    def lap(self, name: str) -> None:
+        now = time.perf_counter()
+        self.laps[name] = now - self._last
+        self._last = now
+
+
+def _ms(duration: int) -> float:
+    return duration / 1_000_000
+
+
+def collect_calls(profiles: abc.Iterable[TaskProfile]) -> dict[str, list[int]]:
+    calls: dict[str, list[int]] = {}
+
+    for profile in profiles:
+        for name, (count, duration) in profile.calls.items():
+            stats = calls.setdefault(name, [0, 0])
+            stats[0] += count
+            stats[1] += duration
+
+    return calls
+
+
+def format_profile(profiles: abc.Sequence[TaskProfile], limit: int = 20) -> str:
+    """Summarize the slowest templates and plugin functions."""
+    lines = [
+        f"{'Template':<40} {'Total':>10} "
+        + " ".join(f"{phase.capitalize():>10}" for phase in PHASES)
+    ]
+
+    for profile in sorted(profiles, key=lambda x: x.duration(), reverse=True)[:limit]:
+        lines.append(
+            f"{profile.name:<40} {_ms(profile.duration()):>10.2f} "
+            + " ".join(f"{_ms(profile.duration(phase)):>10.2f}" for phase in PHASES)
+        )
+
+    if calls := collect_calls(profiles):
+        lines.append("")
+        lines.append(f"{'Plugin function':<40} {'Calls':>10} {'Total':>10}")
+
+        for name, (count, duration) in sorted(
+            calls.items(), key=lambda x: x[1][1], reverse=True
+        )[:limit]:
+            lines.append(f"{name:<40} {count:>10} {_ms(duration):>10.2f}")
+
+    lines.append("All durations in milliseconds.")
+    return "\n".join(lines)
+
+
+def write_profile(
+    profiles: abc.Sequence[TaskProfile], path: Path, format: ProfileFormat
+) -> None:
+    if format is ProfileFormat.chrome:
+        obj: Any = {"traceEvents": _trace_events(profiles), "displayTimeUnit": "ms"}
+    else:
+        obj = {
+            "templates": [
+                {
+                    "name": profile.name,
+                    "total": _ms(profile.duration()),
+                    **{phase: _ms(profile.duration(phase)) for phase in PHASES},
+                }
+                for profile in profiles
+            ],
+            "calls": [
+                {"name": name, "count": count, "total": _ms(duration)}
+                for name, (count, duration) in collect_calls(profiles).items()
+            ],
+        }
+
+    with path.open("w") as fp:
+        json.dump(obj, fp, indent=2)
+
+
+def _trace_events(profiles: abc.Iterable[TaskProfile]) -> list[dict[str, Any]]:
+    """Convert the profiles to the trace event format of Chrome (viewable in Perfetto or `chrome://tracing`)."""
+    events: list[dict[str, Any]] = []
+
+    for profile in profiles:
+        # Timestamps and durations are given in microseconds
+        events.append(
+            {
+                "name": profile.name,
+                "cat": "template",
+                "ph": "X",
+                "ts": profile.start / 1000,
+                "dur": profile.duration() / 1000,
+                "pid": profile.pid,
+                "tid": profile.pid,
+            }
+        )
+        events.extend(
+            {
+                "name": name,
+                "cat": "phase",
+                "ph": "X",
+                "ts": start / 1000,
+                "dur": duration / 1000,
+                "pid": profile.pid,
+                "tid": profile.pid,
+            }
+            for name, start, duration in profile.spans
+        )
+
+    return events
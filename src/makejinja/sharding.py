@@ -0,0 +1,197 @@
+"""Split a run into shards that can be rendered on different machines and combine their outputs afterwards.
+
+Every shard walks all inputs, but only renders its part of the files found.
+Files recorded in the manifest shared by all shards (e.g., the one of the last merged build) stay on their shard,
+so that incremental builds of a shard only need to re-render its own outdated files.
+All other files are assigned with the longest-processing-time-first heuristic:
+starting with the most expensive one, every file is assigned to the shard with the lowest total cost so far.
+The cost of a file is the duration recorded in the shared manifest or its size otherwise.
+As long as all shards see the same inputs and shared manifest, they agree on the partition without communicating.
+Thus, the manifest of a shard's own output is only used to skip its up-to-date files after partitioning.
+"""
+
+import heapq
+import os
+import shutil
+from collections import abc
+from pathlib import Path
+
+from makejinja.app import (
+    RenderTask,
+    Step,
+    log,
+    postprocess_rendered_dirs,
+    remove_stale_output,
+)
+from makejinja.config import Config, CopyMode, parse_shard
+from makejinja.copying import copy_file
+from makejinja.manifest import MANIFEST_NAME, Entry, Manifest
+
+__all__ = ["merge_shards", "partition", "select_shard"]
+
+
+def partition(
+    costs: abc.Sequence[float],
+    count: int,
+    assigned: abc.Sequence[int | None] | None = None,
+) -> list[int]:
+    """Assign every item to one of `count` shards such that the total costs of the shards are balanced.
+
+    Items with a (0-based) shard in `assigned` keep it, the others are distributed around them.
+    Returns the (0-based) shard of every item.
+    """
+    if assigned is None:
+        assigned = [None] * len(costs)
+
+    shards = [0] * len(costs)
+    totals = [0.0] * count
+    unassigned: list[int] = []
+
+    for item, shard in enumerate(assigned):
+        if shard is None:
+            unassigned.append(item)
+        else:
+            shards[item] = shard
+            totals[shard] += costs[item]
+
+    # Total cost and index of every shard
+    loads = [(total, shard) for shard, total in enumerate(totals)]
+    heapq.heapify(loads)
+
+    for item in sorted(unassigned, key=lambda item: (-costs[item], item)):
+        load, shard = heapq.heappop(loads)
+        shards[item] = shard
+        heapq.heappush(loads, (load + costs[item], shard))
+
+    return shards
+
+
+def _manifest_entries(
+    tasks: abc.Sequence[RenderTask], manifest: Manifest, config: Config
+) -> list[Entry | None]:
+    entries: list[Entry | None] = []
+
+    for task in tasks:
+        entry = None
+
+        if task.output.is_relative_to(config.output):
+            key = task.output.relative_to(config.output).as_posix()
+            entry = manifest.outputs.get(key)
+
+        entries.append(entry)
+
+    return entries
+
+
+def task_costs(
+    tasks: abc.Sequence[RenderTask], entries: abc.Sequence[Entry | None]
+) -> list[float]:
+    durations = [
+        entry.get("duration") if entry is not None else None for entry in entries
+    ]
+
+    if recorded := [duration for duration in durations if duration is not None]:
+        # New files are assumed to take as long as an average one
+        average = sum(recorded) / len(recorded)
+
+        return [average if duration is None else duration for duration in durations]
+
+    return [float(_file_size(task.input)) for task in tasks]
+
+
+def _file_size(path: Path) -> int:
+    try:
+        return path.stat().st_size
+    except OSError:
+        return 0
+
+
+def select_shard(steps: abc.Sequence[Step], config: Config) -> list[Step]:
+    """Remove the tasks of all other shards from the steps."""
+    assert config.shard is not None
+    index, count = parse_shard(config.shard)
+
+    tasks = [step for step in steps if isinstance(step, RenderTask)]
+    manifest = (
+        Manifest()
+        if config.shard_manifest is None
+        else Manifest.load(config.shard_manifest)
+    )
+    entries = _manifest_entries(tasks, manifest, config)
+    shards = partition(
+        task_costs(tasks, entries),
+        count,
+        [_recorded_shard(entry, count) for entry in entries],
+    )
+    other_tasks = {id(task) for task, shard in zip(tasks, shards) if shard != index - 1}
+
+    return [step for step in steps if id(step) not in other_tasks]
+
+
+def _recorded_shard(entry: Entry | None, count: int) -> int | None:
+    """Return the (0-based) shard an output has been rendered by if the number of shards is unchanged."""
+    if entry is None or not isinstance(recorded := entry.get("shard"), str):
+        return None
+
+    try:
+        index, recorded_count = parse_shard(recorded)
+    except ValueError:
+        return None
+
+    return index - 1 if recorded_count == count else None
+
+
+def merge_shards(config: Config) -> None:
+    """Copy the outputs of all shards to the output and finish the run like a regular one."""
+    previous_manifest = Manifest.load(config.output / MANIFEST_NAME)
+    manifest = Manifest()
+    # Relative paths of the dirs created by any shard
+    relative_dirs: set[str] = set()
+
+    config.output.mkdir(parents=True, exist_ok=True)
+
+    for shard_output in config.merge_shards:
+        log(f"Merge shard '{shard_output}' -> '{config.output}'", config)
+        shard_manifest = Manifest.load(shard_output / MANIFEST_NAME)
+
+        if manifest.context and shard_manifest.context not in ({}, manifest.context):
+            raise ValueError(
+                f"The shard '{shard_output}' has been rendered with different settings or data."
+            )
+
+        manifest.context = manifest.context or shard_manifest.context
+        manifest.outputs.update(shard_manifest.outputs)
+
+        for directory, _, _ in os.walk(shard_output):
+            if (relative_dir := os.path.relpath(directory, shard_output)) != ".":
+                relative_dirs.add(relative_dir)
+
+        shutil.copytree(
+            shard_output,
+            config.output,
+            # Reflinks are as cheap as links on filesystems supporting them (and copies otherwise),
+            # but do not depend on the shard outputs being kept
+            copy_function=lambda src, dst: copy_file(
+                Path(src), Path(dst), CopyMode.reflink
+            ),
+            ignore=shutil.ignore_patterns(MANIFEST_NAME),
+            dirs_exist_ok=True,
+        )
+
+    if config.incremental:
+        for key in previous_manifest.outputs.keys() - manifest.outputs.keys():
+            remove_stale_output(config.output / key, config)
+
+        manifest.dump(config.output / MANIFEST_NAME)
+
+    # Like in a regular run, the metadata of a dir is copied from the first input containing it
+    input_dirs = [path for path in config.inputs if path.is_dir()]
+    rendered_dirs: dict[Path, Path] = {}
+
+    for relative_dir in relative_dirs:
+        for input_dir in input_dirs:
+            if (input_dir / relative_dir).is_dir():
+                rendered_dirs[config.output / relative_dir] = input_dir / relative_dir
+                break
+
+    postprocess_rendered_dirs(config, rendered_dirs)
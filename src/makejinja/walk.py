@@ -0,0 +1,342 @@
+"""Single-pass traversal of input directories.
+
+Instead of globbing every include pattern separately and checking every exclude pattern per path,
+all patterns are compiled into regular expressions matched against the path strings of a single `os.scandir` walk.
+The walk reuses the file type reported by `scandir` and does not descend into excluded directories.
+In addition, every input directory may contain a `.makejinjaignore` file with gitignore-style patterns.
+The names of the files in all scanned directories can be recorded,
+so that templates can later be looked up without probing the file system.
+"""
+
+import functools
+import os
+import re
+from collections import abc
+from dataclasses import dataclass
+from pathlib import Path
+
+__all__ = ["IgnoreRules", "Listings", "PathMatcher", "WalkEntry", "listing_key", "walk"]
+
+IGNORE_FILE = ".makejinjaignore"
+
+# Patterns are matched case-insensitively on platforms with case-insensitive paths (like pathlib)
+_FLAGS = re.IGNORECASE if os.path.normcase("A") == "a" else 0
+
+# Key: path of a scanned directory (see `listing_key`), Value: names of the files in it
+Listings = dict[str, frozenset[str]]
+
+
+def listing_key(directory: str) -> str:
+    return directory if os.sep == "/" else directory.replace(os.sep, "/")
+
+
+def _translate_part(part: str, escapes: bool = False) -> str:
+    """Translate a glob pattern for a single path component into a regex.
+
+    Like `fnmatch.translate`, but wildcards never match a path separator.
+    If `escapes` is set, a backslash matches the following character literally.
+    """
+    regex = []
+    i, n = 0, len(part)
+
+    while i < n:
+        char = part[i]
+        i += 1
+
+        if char == "\\" and escapes and i < n:
+            regex.append(re.escape(part[i]))
+            i += 1
+        elif char == "*":
+            regex.append("[^/]*")
+        elif char == "?":
+            regex.append("[^/]")
+        elif char == "[":
+            j = i
+
+            if j < n and part[j] == "!":
+                j += 1
+            if j < n and part[j] == "]":
+                j += 1
+            while j < n and part[j] != "]":
+                j += 1
+
+            if j >= n:
+                regex.append("\\[")
+            else:
+                stuff = part[i:j].replace("\\", "\\\\")
+                i = j + 1
+
+                if stuff.startswith("!"):
+                    stuff = "^" + stuff[1:]
+                elif stuff.startswith("^"):
+                    stuff = "\\" + stuff
+
+                regex.append(f"[{stuff}]")
+        else:
+            regex.append(re.escape(char))
+
+    return "".join(regex)
+
+
+def translate_glob(pattern: str) -> tuple[str, bool, int | None]:
+    """Translate a pattern for `Path.glob` into a regex matching relative paths with a leading `/`.
+
+    Returns the regex, whether the pattern only matches directories (i.e., it ends with `**`),
+    and the maximum depth of matched paths (`None` if unlimited).
+    """
+    parts = [part for part in pattern.split("/") if part not in ("", ".")]
+    regex = "".join(
+        "(?:/[^/]+)*" if part == "**" else f"/{_translate_part(part)}" for part in parts
+    )
+    max_depth = None if "**" in parts else len(parts)
+
+    return regex, bool(parts) and parts[-1] == "**", max_depth
+
+
+def translate_match(pattern: str) -> str:
+    """Translate a pattern for `Path.match` into a regex matching full paths.
+
+    Relative patterns are matched from the right, absolute ones against the whole path.
+    As with `Path.match`, the recursive wildcard `**` acts like `*`.
+    """
+    anchored = pattern.startswith("/")
+    parts = [part for part in pattern.split("/") if part not in ("", ".")]
+    regex = "/".join(_translate_part(part.replace("**", "*")) for part in parts)
+
+    return f"^/{regex}$" if anchored else f"(?:^|/){regex}$"
+
+
+def translate_gitignore(line: str) -> tuple[str, bool, bool] | None:
+    """Translate a line of a gitignore file into a regex matching relative paths with a leading `/`.
+
+    Returns the regex, whether the pattern is negated (`!`), and whether it only matches directories (trailing `/`).
+    Returns `None` for blank lines and comments.
+    """
+    # Trailing spaces are ignored unless they are escaped
+    stripped = line.rstrip("\n").rstrip(" ")
+
+    if line.rstrip("\n").endswith("\\ ") and stripped.endswith("\\"):
+        stripped += " "
+
+    if not stripped or stripped.startswith("#"):
+        return None
+
+    negated = stripped.startswith("!")
+
+    if negated:
+        stripped = stripped[1:]
+
+    dirs_only = stripped.endswith("/")
+    stripped = stripped.rstrip("/")
+
+    # Patterns with a separator at the beginning or in the middle are relative to the ignore file
+    anchored = "/" in stripped
+    parts = [part for part in stripped.split("/") if part]
+
+    if not parts:
+        return None
+
+    regex = "" if anchored or parts[0] == "**" else "(?:/[^/]+)*"
+
+    for i, part in enumerate(parts):
+        if part != "**":
+            regex += f"/{_translate_part(part, escapes=True)}"
+        elif i == len(parts) - 1:
+            # A trailing `/**` matches everything inside, but not the directory itself
+            regex += "(?:/[^/]+)+"
+        else:
+            regex += "(?:/[^/]+)*"
+
+    return regex, negated, dirs_only
+
+
+@dataclass(slots=True, frozen=True)
+class IgnoreRules:
+    """Gitignore-style rules compiled into a single regex per path type.
+
+    The rules are combined in reverse order, so the first matching alternative is the last matching rule,
+    which decides whether a path is ignored or re-included.
+    Thus, checking a path takes a single regex match regardless of the number of rules.
+    """
+
+    files: re.Pattern[str] | None
+    file_negations: tuple[bool, ...]
+    dirs: re.Pattern[str] | None
+    dir_negations: tuple[bool, ...]
+
+    @classmethod
+    def parse(cls, lines: abc.Iterable[str]) -> "IgnoreRules":
+        rules = [rule for line in lines if (rule := translate_gitignore(line))]
+        rules.reverse()
+        file_rules = [rule for rule in rules if not rule[2]]
+
+        return cls(
+            files=_compile([f"({regex})" for regex, _, _ in file_rules], "^(?:{})$"),
+            file_negations=tuple(negated for _, negated, _ in file_rules),
+            dirs=_compile([f"({regex})" for regex, _, _ in rules], "^(?:{})$"),
+            dir_negations=tuple(negated for _, negated, _ in rules),
+        )
+
+    @classmethod
+    def from_file(cls, path: Path) -> "IgnoreRules | None":
+        try:
+            with path.open(encoding="utf-8") as fp:
+                return cls.parse(fp)
+        except FileNotFoundError:
+            return None
+
+    def ignores(self, relative_path: str, is_dir: bool) -> bool:
+        regex, negations = (
+            (self.dirs, self.dir_negations)
+            if is_dir
+            else (self.files, self.file_negations)
+        )
+
+        if regex is None or (match := regex.match(relative_path)) is None:
+            return False
+
+        assert match.lastindex is not None
+        return not negations[match.lastindex - 1]
+
+
+@dataclass(slots=True, frozen=True)
+class PathMatcher:
+    """Combined include and exclude patterns of an input directory."""
+
+    files: re.Pattern[str] | None
+    dirs: re.Pattern[str] | None
+    exclude: re.Pattern[str] | None
+    max_depth: int | None
+
+    @classmethod
+    @functools.cache
+    def from_patterns(
+        cls, include_patterns: tuple[str, ...], exclude_patterns: tuple[str, ...]
+    ) -> "PathMatcher":
+        file_regexes: list[str] = []
+        dir_regexes: list[str] = []
+        depths: list[int | None] = []
+
+        for pattern in include_patterns:
+            regex, dirs_only, max_depth = translate_glob(pattern)
+            dir_regexes.append(regex)
+            depths.append(max_depth)
+
+            if not dirs_only:
+                file_regexes.append(regex)
+
+        return cls(
+            files=_compile(file_regexes, "^(?:{})$"),
+            dirs=_compile(dir_regexes, "^(?:{})$"),
+            exclude=_compile([translate_match(x) for x in exclude_patterns], "(?:{})"),
+            max_depth=None
+            if None in depths
+            else max((depth for depth in depths if depth is not None), default=0),
+        )
+
+    def includes(self, relative_path: str, is_dir: bool) -> bool:
+        regex = self.dirs if is_dir else self.files
+        return regex is not None and regex.match(relative_path) is not None
+
+    def excludes(self, path: str) -> bool:
+        return self.exclude is not None and self.exclude.search(path) is not None
+
+
+def _compile(regexes: abc.Sequence[str], template: str) -> re.Pattern[str] | None:
+    if not regexes:
+        return None
+
+    return re.compile(template.format("|".join(regexes)), _FLAGS)
+
+
+@dataclass(slots=True, frozen=True)
+class WalkEntry:
+    path: Path
+    relative_path: Path
+    is_dir: bool
+    is_file: bool
+    excluded: bool
+
+
+def walk(
+    root: Path,
+    matcher: PathMatcher,
+    path_filters: abc.Sequence[abc.Callable[[Path], bool]] = (),
+    listings: Listings | None = None,
+) -> abc.Iterator[WalkEntry]:
+    """Yield all paths below `root` matched by the include patterns in sorted order (like `sorted(root.glob(...))`).
+
+    Excluded paths are yielded as well (to report them), but excluded directories are not descended into.
+    Paths ignored by the `.makejinjaignore` file in `root` are treated as excluded.
+    If `listings` is given, the names of all files in the scanned directories are added to it
+    (including files not matched by the include patterns).
+    """
+    ignore_rules = IgnoreRules.from_file(root / IGNORE_FILE)
+
+    yield from _walk(str(root), "", 1, matcher, ignore_rules, path_filters, listings)
+
+
+def _walk(
+    directory: str,
+    relative_dir: str,
+    depth: int,
+    matcher: PathMatcher,
+    ignore_rules: IgnoreRules | None,
+    path_filters: abc.Sequence[abc.Callable[[Path], bool]],
+    listings: Listings | None,
+) -> abc.Iterator[WalkEntry]:
+    try:
+        with os.scandir(directory) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        return
+
+    if listings is not None:
+        listings[listing_key(directory)] = frozenset(
+            entry.name for entry in entries if not entry.is_dir()
+        )
+
+    descend = matcher.max_depth is None or depth < matcher.max_depth
+
+    for entry in entries:
+        relative_path = f"{relative_dir}/{entry.name}"
+
+        if relative_path == f"/{IGNORE_FILE}":
+            continue
+
+        full_path = entry.path if os.sep == "/" else entry.path.replace(os.sep, "/")
+        is_dir = entry.is_dir()
+        included = matcher.includes(relative_path, is_dir)
+
+        if not included and not (is_dir and descend):
+            continue
+
+        path = Path(entry.path)
+        excluded = (
+            matcher.excludes(full_path)
+            or (
+                ignore_rules is not None and ignore_rules.ignores(relative_path, is_dir)
+            )
+            or any(not path_filter(path) for path_filter in path_filters)
+        )
+
+        if included:
+            yield WalkEntry(
+                path,
+                Path(relative_path[1:]),
+                is_dir,
+                not is_dir and entry.is_file(),
+                excluded,
+            )
+
+        # Like `Path.glob`, symlinks to directories are not followed
+        if is_dir and descend and not excluded and not entry.is_symlink():
+            yield from _walk(
+                entry.path,
+                relative_path,
+                depth + 1,
+                matcher,
+                ignore_rules,
+                path_filters,
+                listings,
+            )
@@ -0,0 +1,462 @@
+"""Keep makejinja running and re-render the affected outputs whenever a watched file changes.
+
+The Jinja environment, the loaded data, and the plugins stay in memory between changes.
+For every template, the templates it includes, imports, or extends are tracked,
+so editing a partial only re-renders the templates using it.
+Changes are detected with inotify on Linux and by periodically scanning the watched paths otherwise.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from collections import abc
+from dataclasses import replace
+from pathlib import Path
+
+import rich_click as click
+from jinja2 import ChoiceLoader, DictLoader, TemplateError
+
+from makejinja.app import (
+    RenderTask,
+    RunState,
+    Step,
+    clear_parsed_data,
+    generate_output_path,
+    handle_input_dir,
+    input_errors,
+    is_template,
+    load_data,
+    log,
+    remove_stale_output,
+    render_task,
+    run,
+    update_env_data,
+)
+from makejinja.config import Config
+from makejinja.manifest import template_closure
+
+__all__ = ["watch"]
+
+POLL_INTERVAL = 0.5
+DEBOUNCE_INTERVAL = 0.05
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_MASK = (
+    IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+)
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def _abspath(path: Path | str) -> Path:
+    # Unlike `Path.resolve`, this does not touch the file system
+    return Path(os.path.abspath(path))
+
+
+class InotifyWatcher:
+    """Watch directories (recursively) and the parents of files via the Linux inotify API."""
+
+    def __init__(self, roots: abc.Iterable[Path]) -> None:
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd: int = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+        self._roots = list(roots)
+        self._dirs: dict[int, Path] = {}
+
+        for root in self._roots:
+            if root.is_dir():
+                self._add_tree(root)
+            else:
+                self._add(root.parent)
+
+    def _add(self, directory: Path) -> None:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), IN_MASK)
+
+        if wd >= 0:
+            self._dirs[wd] = directory
+
+    def _add_tree(self, root: Path) -> None:
+        self._add(root)
+
+        for dirpath, dirnames, _ in os.walk(root):
+            for dirname in dirnames:
+                self._add(Path(dirpath, dirname))
+
+    def _read(self) -> set[Path]:
+        changed: set[Path] = set()
+
+        while True:
+            try:
+                buffer = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+
+            offset = 0
+
+            while offset < len(buffer):
+                wd, mask, _, length = INOTIFY_EVENT.unpack_from(buffer, offset)
+                offset += INOTIFY_EVENT.size
+                name = buffer[offset : offset + length].rstrip(b"\0")
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    # Events were lost, so everything may have changed
+                    changed.update(self._roots)
+                    continue
+
+                if (directory := self._dirs.get(wd)) is None:
+                    continue
+
+                if mask & IN_IGNORED:
+                    del self._dirs[wd]
+                    continue
+
+                path = directory / os.fsdecode(name) if name else directory
+
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    self._add_tree(path)
+
+                changed.add(path)
+
+    def wait(self) -> set[Path]:
+        """Block until at least one watched path changed and return all changed paths."""
+        while True:
+            select.select([self._fd], [], [])
+            changed = self._read()
+
+            # Editors often write files in several steps, so collect events arriving shortly after
+            while select.select([self._fd], [], [], DEBOUNCE_INTERVAL)[0]:
+                changed |= self._read()
+
+            if changed:
+                return changed
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """Watch paths by comparing the modification time and size of all files periodically."""
+
+    def __init__(self, roots: abc.Iterable[Path]) -> None:
+        self._roots = list(roots)
+        self._snapshot = self._scan()
+
+    def _scan(self) -> dict[Path, tuple[int, int]]:
+        snapshot: dict[Path, tuple[int, int]] = {}
+
+        for root in self._roots:
+            paths: abc.Iterable[Path] = [root]
+
+            if root.is_dir():
+                paths = (
+                    Path(dirpath, name)
+                    for dirpath, dirnames, filenames in os.walk(root)
+                    for name in (*dirnames, *filenames)
+                )
+
+            for path in paths:
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+
+                snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+
+        return snapshot
+
+    def wait(self) -> set[Path]:
+        """Block until at least one watched path changed and return all changed paths."""
+        while True:
+            time.sleep(POLL_INTERVAL)
+            snapshot = self._scan()
+            changed = {
+                path
+                for path in snapshot.keys() | self._snapshot.keys()
+                if snapshot.get(path) != self._snapshot.get(path)
+            }
+            self._snapshot = snapshot
+
+            if changed:
+                return changed
+
+    def close(self) -> None:
+        pass
+
+
+def init_watcher(roots: abc.Iterable[Path]) -> InotifyWatcher | PollingWatcher:
+    roots = list(roots)
+
+    if sys.platform == "linux":
+        try:
+            return InotifyWatcher(roots)
+        except (OSError, AttributeError):
+            pass
+
+    return PollingWatcher(roots)
+
+
+class WatchSession:
+    """Track which outputs depend on which files and re-render them on changes."""
+
+    def __init__(self, config: Config, state: RunState) -> None:
+        self.config = config
+        self.state = state
+        self.output = _abspath(config.output)
+        self.input_dirs = [_abspath(path) for path in config.inputs if path.is_dir()]
+        self.input_files = [_abspath(path) for path in config.inputs if path.is_file()]
+        self.data_paths = [_abspath(path) for path in config.data]
+        self.data_loaders = state.data_loaders
+        self.file_data: dict[Path, set[str]] = {}
+
+        for template_name, data_paths in config.file_data.items():
+            for path in data_paths:
+                self.file_data.setdefault(_abspath(path), set()).add(template_name)
+
+        # Key: output path
+        self.tasks: dict[Path, RenderTask] = {}
+        # Key: input path, Value: output path
+        self.outputs: dict[Path, Path] = {}
+        # Key: template file, Value: output paths of the templates using it
+        self.dependents: dict[Path, set[Path]] = {}
+        # Key: output path, Value: template files it depends on
+        self.dependencies: dict[Path, set[Path]] = {}
+        # Output paths of templates with includes/imports only known at render time
+        self.dynamic: set[Path] = set()
+
+        for task in state.tasks:
+            self.add_task(task)
+
+    @property
+    def roots(self) -> list[Path]:
+        return [
+            *self.input_dirs,
+            *self.input_files,
+            *self.data_paths,
+            *self.file_data,
+        ]
+
+    def add_task(self, task: RenderTask) -> None:
+        self.tasks[task.output] = task
+        self.outputs[_abspath(task.input)] = task.output
+        self.update_dependencies(task)
+
+    def remove_task(self, task: RenderTask) -> None:
+        del self.tasks[task.output]
+        self.outputs.pop(_abspath(task.input), None)
+        self.dynamic.discard(task.output)
+
+        for path in self.dependencies.pop(task.output, ()):
+            self.dependents[path].discard(task.output)
+
+    def update_dependencies(self, task: RenderTask) -> None:
+        for path in self.dependencies.pop(task.output, ()):
+            self.dependents[path].discard(task.output)
+
+        self.dynamic.discard(task.output)
+
+        if not is_template(task.input, self.config, task.enforce_jinja_suffix):
+            return
+
+        try:
+            closure = template_closure(task.template_name, self.state.env)
+        except (TemplateError, OSError, ValueError):
+            # Broken templates are reported when rendering them
+            closure = None
+
+        if closure is None:
+            self.dynamic.add(task.output)
+            return
+
+        paths = {
+            _abspath(template["path"])
+            for template in closure.values()
+            if template["path"] is not None
+        }
+        self.dependencies[task.output] = paths
+
+        for path in paths:
+            self.dependents.setdefault(path, set()).add(task.output)
+
+    def is_data_file(self, path: Path) -> bool:
+        return path.suffix in self.data_loaders and any(
+            path == data_path or path.is_relative_to(data_path)
+            for data_path in self.data_paths
+        )
+
+    def handle(self, changed: abc.Iterable[Path]) -> None:
+        """Re-render all outputs affected by the changed paths."""
+        start = time.perf_counter()
+        changed = {path for path in changed if not path.is_relative_to(self.output)}
+        dirty: set[Path] = set()
+        restructure = False
+        clear_parsed_data()
+
+        if any(self.is_data_file(path) for path in changed):
+            self.reload_data()
+            dirty.update(
+                output
+                for output, task in self.tasks.items()
+                if is_template(task.input, self.config, task.enforce_jinja_suffix)
+            )
+
+        for path in changed:
+            for template_name in self.file_data.get(path, ()):
+                dirty.update(
+                    output
+                    for output, task in self.tasks.items()
+                    if task.template_name == template_name
+                )
+
+            if path in self.input_files:
+                self.render_input_file(path)
+
+            if not any(path.is_relative_to(root) for root in self.input_dirs):
+                continue
+
+            known = path in self.outputs or path in self.dependents
+
+            if path.exists() != known:
+                # A file was added or removed, so the inputs have to be walked again
+                restructure = True
+
+            if (output := self.outputs.get(path)) is not None:
+                dirty.add(output)
+
+            dirty.update(self.dependents.get(path, ()))
+            dirty.update(self.dynamic)
+
+        if restructure:
+            dirty.update(self.rewalk())
+
+        if not dirty:
+            return
+
+        if (cache := self.state.env.cache) is not None:
+            cache.clear()
+
+        tasks = [self.tasks[output] for output in sorted(dirty) if output in self.tasks]
+
+        for task in tasks:
+            self.render(task)
+
+        duration = (time.perf_counter() - start) * 1000
+        log(f"Updated {len(tasks)} output(s) in {duration:.1f} ms", self.config)
+
+    def render(self, task: RenderTask) -> None:
+        try:
+            # The outputs have been rendered before, so they are overwritten even without `force`
+            result = render_task(
+                replace(task, overwrite=True),
+                self.config,
+                self.state.env,
+                self.data_loaders,
+            )
+        except input_errors() as e:
+            # Keep watching, the error is most likely fixed with the next change
+            log(f"Failed to render '{task.input}': {e}", self.config)
+            return
+
+        for message in result.messages:
+            log(message, self.config)
+
+        self.update_dependencies(task)
+
+    def reload_data(self) -> None:
+        data = load_data(self.config, self.data_loaders)
+        update_env_data(self.state.env, data, self.state.data)
+        self.state.data = data
+
+    def render_input_file(self, path: Path) -> None:
+        """Re-render an input file that has been passed directly instead of via a dir."""
+        loader = self.state.env.loader
+        loaders = loader.loaders if isinstance(loader, ChoiceLoader) else [loader]
+
+        for dict_loader in loaders:
+            if isinstance(dict_loader, DictLoader) and path.name in dict_loader.mapping:
+                dict_loader.mapping[path.name] = path.read_text()
+
+        relative_path = Path(path.name)
+        output = generate_output_path(self.config, relative_path)
+        self.render(RenderTask(path, str(relative_path), output, False))
+
+    def rewalk(self) -> set[Path]:
+        """Walk the input dirs again, returning the outputs of new tasks and removing the outputs of deleted ones."""
+        steps: list[Step] = []
+        rendered_files: dict[Path, Path] = {}
+        # Files may have been added to or removed from the scanned directories
+        self.state.listings.clear()
+
+        for user_input_path in self.config.inputs:
+            if user_input_path.is_dir():
+                handle_input_dir(
+                    user_input_path,
+                    self.config,
+                    rendered_files,
+                    self.state.rendered_dirs,
+                    self.state.plugin_path_filters,
+                    steps,
+                    self.state.listings,
+                )
+
+        tasks = {step.output: step for step in steps if isinstance(step, RenderTask)}
+        added: set[Path] = set()
+
+        for output in self.tasks.keys() - tasks.keys():
+            self.remove_task(self.tasks[output])
+            remove_stale_output(output, self.config)
+
+        for output, task in tasks.items():
+            if (previous := self.tasks.get(output)) != task:
+                if previous is not None:
+                    self.remove_task(previous)
+
+                self.add_task(task)
+                added.add(output)
+
+        return added
+
+
+def watch(config: Config) -> None:
+    """Render all templates and re-render the affected ones whenever a watched file changes."""
+    if config.plan:
+        raise click.UsageError(
+            "Planning a run (`--plan`) cannot be combined with `--watch`."
+        )
+
+    if config.merge_shards:
+        raise click.UsageError(
+            "Merging shards (`--merge-shard`) cannot be combined with `--watch`."
+        )
+
+    state = run(config)
+    session = WatchSession(config, state)
+    watcher = init_watcher(session.roots)
+
+    log(
+        f"Watching {len(session.roots)} path(s) for changes using {type(watcher).__name__}",
+        config,
+    )
+
+    try:
+        while True:
+            session.handle(watcher.wait())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
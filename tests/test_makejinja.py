@@ -1,8 +1,18 @@
+import json
+import os
+import signal
+import stat
+import subprocess
+import sys
+from collections import abc
 from dataclasses import dataclass
 from pathlib import Path
+from typing import Any
 
 import pytest
+from attrs import evolve
 from click.testing import CliRunner
+from jinja2 import TemplateNotFound
 
 
 @dataclass(slots=True, frozen=True)
@@ -23,6 +33,16 @@ class MakejinjaPaths:
         return "makejinja"
 
 
+@pytest.fixture(scope="session", autouse=True)
+def cache_home(tmp_path_factory: pytest.TempPathFactory) -> abc.Iterator[Path]:
+    """Keep the data and bytecode caches of all tests out of the user's cache dir."""
+    path = tmp_path_factory.mktemp("cache")
+
+    with pytest.MonkeyPatch.context() as m:
+        m.setenv("XDG_CACHE_HOME", str(path))
+        yield path
+
+
 @pytest.fixture(scope="session")
 def test_run(tmp_path_factory: pytest.TempPathFactory) -> MakejinjaPaths:
     """Execute makejinja on test data and return paths to input, expected, and actual output."""
@@ -150,3 +170,1010 @@ def test_nested_directory_processing(test_run: MakejinjaPaths):
     assert len(content.strip()) > 0, (
         f"Nested template should have content but {nested_file} is empty"
     )
+
+
+def _invoke(output_path: Path, *args: str) -> str:
+    """Execute makejinja on the test data with additional CLI arguments and return its log output."""
+    assert __package__ is not None
+    data_path = Path(__package__, "data")
+
+    with pytest.MonkeyPatch.context() as m:
+        m.chdir(data_path)
+
+        from makejinja.cli import makejinja_cli
+
+        result = CliRunner().invoke(
+            makejinja_cli,
+            ["--output", str(output_path), *args],
+            catch_exceptions=False,
+        )
+
+    assert result.exit_code == 0, result.output
+
+    return result.output
+
+
+def test_parallel_rendering(test_run: MakejinjaPaths, tmp_path: Path):
+    """Test that rendering with multiple jobs produces the same output and log order."""
+    serial_output = _invoke(tmp_path / "serial")
+    parallel_output = _invoke(tmp_path / "parallel", "--jobs", "2")
+
+    assert _dir_content(tmp_path / "parallel") == _dir_content(test_run.output)
+    assert (
+        parallel_output.replace(str(tmp_path / "parallel"), str(tmp_path / "serial"))
+        == serial_output
+    )
+
+
+def test_incremental_rendering(tmp_path: Path):
+    """Test that incremental runs skip up-to-date outputs and remove stale ones."""
+    output_path = tmp_path / "output"
+    _invoke(output_path, "--incremental")
+
+    manifest_path = output_path / ".makejinja-manifest.json"
+    manifest = json.loads(manifest_path.read_text())
+    assert "ui-lovelace.yaml" in manifest["outputs"]
+
+    # Simulate an output whose source has been deleted in the meantime
+    stale_path = output_path / "stale" / "removed.yaml"
+    stale_path.parent.mkdir()
+    stale_path.write_text("stale")
+    manifest["outputs"]["stale/removed.yaml"] = {
+        "source": "input1/removed.yaml",
+        "hash": None,
+    }
+    # Manifests must not be able to remove files outside of the output
+    outside_path = tmp_path / "outside.txt"
+    outside_path.write_text("outside")
+    manifest["outputs"]["../outside.txt"] = {"source": "input1/x", "hash": None}
+    manifest_path.write_text(json.dumps(manifest))
+
+    log_output = _invoke(output_path, "--incremental")
+
+    assert f"Skip up-to-date file '{output_path / 'ui-lovelace.yaml'}'" in log_output
+    assert "Render file" not in log_output
+    assert not stale_path.parent.exists()
+    assert outside_path.exists()
+
+    # Settings that do not affect the outputs keep them up to date
+    log_output = _invoke(
+        output_path,
+        "--incremental",
+        "--no-data-cache",
+        "--internal-async-concurrency",
+        "5",
+    )
+    assert "Render file" not in log_output
+
+
+def test_bytecode_cache(test_run: MakejinjaPaths, tmp_path: Path):
+    """Test that compiled templates are cached per Jinja settings."""
+    cache_path = tmp_path / "cache"
+    _invoke(tmp_path / "first", "--bytecode-cache", str(cache_path))
+    cached_files = set(cache_path.iterdir())
+    assert cached_files
+
+    _invoke(tmp_path / "second", "--bytecode-cache", str(cache_path))
+    assert set(cache_path.iterdir()) == cached_files
+    assert _dir_content(tmp_path / "second") == _dir_content(test_run.output)
+
+    _invoke(tmp_path / "third", "--bytecode-cache", str(cache_path), "--no-trim-blocks")
+    assert set(cache_path.iterdir()) > cached_files
+
+
+def test_watch_session(tmp_path: Path):
+    """Test that watch mode only re-renders the outputs affected by a change."""
+    from makejinja.app import run
+    from makejinja.cli import makejinja_cli
+    from makejinja.config import Config
+    from makejinja.watch import WatchSession
+
+    input_path = tmp_path / "input"
+    output_path = tmp_path / "output"
+    input_path.mkdir()
+    (input_path / "page.txt.jinja").write_text("{% include 'partial.txt' %}")
+    (input_path / "other.txt.jinja").write_text("other")
+    (input_path / "partial.txt").write_text("v1")
+
+    config = Config(
+        inputs=(input_path,),
+        output=output_path,
+        exclude_patterns=("partial.txt",),
+        quiet=True,
+    )
+    session = WatchSession(config, run(config))
+    assert (output_path / "page.txt").read_text() == "v1"
+    os.utime(output_path / "other.txt", (0, 0))
+
+    (input_path / "partial.txt").write_text("v2")
+    session.handle({input_path / "partial.txt"})
+    assert (output_path / "page.txt").read_text() == "v2"
+    assert (output_path / "other.txt").stat().st_mtime == 0
+
+    (input_path / "new.txt.jinja").write_text("new")
+    session.handle({input_path / "new.txt.jinja"})
+    assert (output_path / "new.txt").read_text() == "new"
+
+    (input_path / "other.txt.jinja").unlink()
+    session.handle({input_path / "other.txt.jinja"})
+    assert not (output_path / "other.txt").exists()
+
+    # Planning never writes outputs, so it cannot be watched
+    planned_path = tmp_path / "planned"
+    args = ["--input", str(input_path), "--output", str(planned_path), "--watch"]
+    result = CliRunner().invoke(makejinja_cli, [*args, "--plan"])
+    assert result.exit_code == 2
+    assert "--plan" in result.output
+    assert not planned_path.exists()
+
+    result = CliRunner().invoke(
+        makejinja_cli, [*args, "--merge-shard", str(output_path)]
+    )
+    assert result.exit_code == 2
+    assert "--merge-shard" in result.output
+    assert not planned_path.exists()
+
+
+def test_write_if_changed(tmp_path: Path):
+    """Test that identical outputs are not rewritten when forcing a new run."""
+    output_path = tmp_path / "output"
+    _invoke(output_path)
+    os.utime(output_path / "ui-lovelace.yaml", (0, 0))
+    os.utime(output_path / "extra-file.yaml", (0, 0))
+
+    log_output = _invoke(output_path, "--force", "--write-if-changed")
+
+    assert (output_path / "ui-lovelace.yaml").stat().st_mtime == 0
+    assert (output_path / "extra-file.yaml").stat().st_mtime == 0
+    assert "Summary: 5 unchanged" in log_output
+
+
+def test_streaming_rendering(test_run: MakejinjaPaths, tmp_path: Path):
+    """Test that streaming templates to their outputs produces the same files."""
+    output_path = tmp_path / "output"
+    _invoke(output_path, "--stream")
+
+    assert _dir_content(output_path) == _dir_content(test_run.output)
+
+    for item in _dir_content(output_path):
+        if (output_path / item).is_file():
+            assert (output_path / item).read_text() == (
+                test_run.output / item
+            ).read_text()
+
+
+@pytest.mark.parametrize(
+    ("existing", "changed"),
+    [
+        ("first\nsecond\n", False),
+        ("first\nthird\n", True),
+        ("first\n", True),
+        ("first\nsecond\nthird\n", True),
+    ],
+)
+def test_write_changed_chunks(tmp_path: Path, existing: str, changed: bool):
+    """Test that streamed outputs are only modified starting at the first difference."""
+    from makejinja.app import write_changed_chunks
+
+    path = tmp_path / "output.txt"
+    path.write_text(existing)
+
+    assert write_changed_chunks(path, ["first\n", "sec", "ond\n"]) is changed
+    assert path.read_text() == "first\nsecond\n"
+
+
+def test_lazy_namespaced_data(tmp_path: Path):
+    """Test that namespaced data files are only parsed once a template uses them."""
+    from makejinja.app import LazyData, run
+    from makejinja.config import Config
+
+    data_path = tmp_path / "data"
+    input_path = tmp_path / "input"
+    (data_path / "nested").mkdir(parents=True)
+    input_path.mkdir()
+    (data_path / "site.yaml").write_text("title: Example")
+    (data_path / "nested" / "unused.yaml").write_text("invalid: [")
+    (input_path / "page.txt.jinja").write_text("{{ site.title }} {{ site | tojson }}")
+
+    config = Config(
+        inputs=(input_path,),
+        output=tmp_path / "output",
+        data=(data_path,),
+        namespace_data=True,
+        lazy_data=True,
+        quiet=True,
+    )
+    state = run(config)
+
+    assert (tmp_path / "output" / "page.txt").read_text() == (
+        'Example {"title": "Example"}'
+    )
+    assert isinstance(state.data["nested"]["unused"], LazyData)
+
+
+def test_data_cache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """Test that parsed data files are reused until their content changes."""
+    from makejinja.app import load_data
+    from makejinja.cache import DataCache
+    from makejinja.config import Config
+
+    calls: list[Path] = []
+
+    def loader(path: Path) -> dict[str, str]:
+        calls.append(path)
+        return {"value": path.read_text()}
+
+    data_path = tmp_path / "data.txt"
+    data_path.write_text("v1")
+    cache = DataCache(tmp_path / "cache", 1024 * 1024)
+
+    assert cache.load(data_path, loader) == {"value": "v1"}
+    assert cache.load(data_path, loader) == {"value": "v1"}
+    os.utime(data_path, (0, 0))
+    assert cache.load(data_path, loader) == {"value": "v1"}
+    assert len(calls) == 1
+
+    data_path.write_text("v2")
+    assert cache.load(data_path, loader) == {"value": "v2"}
+    assert len(calls) == 2
+
+    # Changing the code of a loader invalidates its entries
+    def loader(path: Path) -> dict[str, str]:  # noqa: F811
+        calls.append(path)
+        return {"value": path.read_text().upper()}
+
+    assert cache.load(data_path, loader) == {"value": "V2"}
+    assert len(calls) == 3
+
+    def missing_home() -> Path:
+        raise RuntimeError("Could not determine home directory.")
+
+    # Without a home dir, data is loaded without the default cache
+    monkeypatch.delenv("XDG_CACHE_HOME")
+    monkeypatch.setattr(Path, "home", missing_home)
+    (tmp_path / "data.yaml").write_text("key: value")
+    config = Config(
+        inputs=(), output=tmp_path / "output", data=(tmp_path / "data.yaml",)
+    )
+    assert load_data(config) == {"key": "value"}
+
+
+def test_custom_data_loader(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """Test that plugins and the config can register data loaders for additional suffixes."""
+    from makejinja.app import collect_data_loaders, from_yaml, load_data
+    from makejinja.config import Config
+
+    monkeypatch.syspath_prepend(tmp_path)
+    (tmp_path / "csv_plugin.py").write_text(
+        "def load_csv(path):\n"
+        "    return dict(line.split(',') for line in path.read_text().splitlines())\n"
+        "\n"
+        "class Plugin:\n"
+        "    @classmethod\n"
+        "    def data_loaders(cls):\n"
+        "        return {'.csv': load_csv}\n"
+    )
+    data_path = tmp_path / "data"
+    data_path.mkdir()
+    (data_path / "values.csv").write_text("title,Example\n")
+    (data_path / "values.tsv").write_text("other,true\n")
+
+    config = Config(
+        inputs=(),
+        output=tmp_path / "output",
+        data=(data_path,),
+        plugins=("csv_plugin:Plugin",),
+        data_loaders={"tsv": "csv_plugin:load_csv"},
+        quiet=True,
+    )
+
+    assert collect_data_loaders(config)[".yml"] is from_yaml
+    assert load_data(config) == {"title": "Example", "other": "true"}
+
+
+def test_shared_file_data(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """Test that data files and loaders shared by multiple templates are only set up once per run."""
+    from makejinja import app
+    from makejinja.config import Config, Internal
+
+    calls: list[Path] = []
+    loader_calls: list[Config] = []
+    collect_data_loaders = app.collect_data_loaders
+
+    def from_yaml(path: Path) -> dict[str, Any]:
+        calls.append(path)
+        return {"shared": {"value": path.stem}}
+
+    def collect_data_loaders_spy(config: Config) -> dict[str, Any]:
+        loader_calls.append(config)
+        return collect_data_loaders(config)
+
+    monkeypatch.setitem(app.DATA_LOADERS, ".yaml", from_yaml)
+    monkeypatch.setattr(app, "collect_data_loaders", collect_data_loaders_spy)
+    input_path = tmp_path / "input"
+    input_path.mkdir()
+    (input_path / "a.txt.jinja").write_text("{{ shared.value }} {{ shared.name }}")
+    (input_path / "b.txt.jinja").write_text("{{ shared.value }}")
+    common_path = tmp_path / "common.yaml"
+    common_path.write_text("")
+
+    config = Config(
+        inputs=(input_path,),
+        output=tmp_path / "output",
+        data=(common_path,),
+        data_vars={"shared.name": "override"},
+        file_data={
+            "a.txt.jinja": (common_path,),
+            "b.txt.jinja": (common_path,),
+        },
+        quiet=True,
+        internal=Internal(data_cache=False),
+    )
+    app.run(config)
+
+    assert calls == [common_path]
+    assert loader_calls == [config]
+    assert (tmp_path / "output" / "a.txt").read_text() == "common "
+    assert (tmp_path / "output" / "b.txt").read_text() == "common"
+
+
+@pytest.mark.parametrize("pattern", ["**/*", "*", "**/*.txt", "sub/*", "*/[!c]*"])
+def test_walk(tmp_path: Path, pattern: str):
+    """Test that the directory walk yields the same paths as `Path.glob` and prunes excluded dirs."""
+    from makejinja.walk import PathMatcher, walk
+
+    for name in ("a.txt", "sub/b.txt", "sub/c.yaml", "sub/deep/d.txt", ".hidden"):
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).touch()
+
+    matcher = PathMatcher.from_patterns((pattern,), ())
+    assert [entry.path for entry in walk(tmp_path, matcher)] == sorted(
+        tmp_path.glob(pattern)
+    )
+
+    matcher = PathMatcher.from_patterns((pattern,), ("deep", "*.yaml"))
+    for entry in walk(tmp_path, matcher):
+        assert entry.excluded == (
+            entry.path.match("deep") or entry.path.match("*.yaml")
+        )
+        assert "deep" not in entry.path.parent.parts
+
+
+def test_ignore_file(tmp_path: Path):
+    """Test that paths listed in `.makejinjaignore` are excluded and their subtrees pruned."""
+    from makejinja.walk import PathMatcher, walk
+
+    for name in (
+        "node_modules/pkg/index.js",
+        "logs/a.log",
+        "logs/keep.log",
+        "page.txt",
+    ):
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).touch()
+
+    (tmp_path / ".makejinjaignore").write_text(
+        "# comment\nnode_modules/\n*.log\n!keep.log\n"
+    )
+    matcher = PathMatcher.from_patterns(("**/*",), ())
+
+    assert {
+        str(entry.relative_path): entry.excluded for entry in walk(tmp_path, matcher)
+    } == {
+        "logs": False,
+        "logs/a.log": True,
+        "logs/keep.log": False,
+        "node_modules": True,
+        "page.txt": False,
+    }
+
+
+@pytest.mark.parametrize("copy_mode", ["copy", "reflink", "hardlink", "symlink"])
+def test_copy_mode(tmp_path: Path, copy_mode: str):
+    """Test that non-template files are transferred with the given mode or a fallback."""
+    input_path = tmp_path / "input"
+    output_path = tmp_path / "output"
+    input_path.mkdir()
+    (input_path / "asset.bin").write_bytes(bytes(range(256)) * 1024)
+    (input_path / "page.txt.jinja").write_text("page")
+
+    for _ in range(2):
+        log_output = _invoke(
+            output_path,
+            "--input",
+            str(input_path),
+            "--copy-mode",
+            copy_mode,
+            "--force",
+        )
+
+    assert (output_path / "asset.bin").read_bytes() == bytes(range(256)) * 1024
+    assert (input_path / "asset.bin").read_bytes() == bytes(range(256)) * 1024
+
+    if copy_mode == "symlink":
+        assert (output_path / "asset.bin").is_symlink()
+        assert "1 linked" in log_output
+    elif copy_mode == "hardlink":
+        assert (output_path / "asset.bin").samefile(input_path / "asset.bin")
+        assert "1 linked" in log_output
+    elif copy_mode == "copy":
+        assert "1 copied (256.0 KiB)" in log_output
+
+
+def test_profile(tmp_path: Path):
+    """Test that profiles contain all templates and plugin calls."""
+    profile_path = tmp_path / "profile.json"
+    _invoke(tmp_path / "output", "--profile-output", str(profile_path))
+
+    with profile_path.open() as fp:
+        profile = json.load(fp)
+
+    assert {template["name"] for template in profile["templates"]} >= {
+        "ui-lovelace.yaml.jinja",
+        "extra-file.yaml",
+    }
+    assert {call["name"]: call["count"] for call in profile["calls"]} == {
+        "filter hassurl": 2,
+        "function getlang": 19,
+    }
+
+
+def test_async_rendering(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """Test that templates using async plugin functions are rendered concurrently."""
+    from makejinja.app import run
+    from makejinja.config import Config, Internal
+
+    monkeypatch.syspath_prepend(tmp_path)
+    (tmp_path / "async_plugin.py").write_text(
+        "import asyncio\n"
+        "\n"
+        "state = {'active': 0, 'max_active': 0}\n"
+        "\n"
+        "async def lookup(key):\n"
+        "    state['active'] += 1\n"
+        "    state['max_active'] = max(state['max_active'], state['active'])\n"
+        "    await asyncio.sleep(0.01)\n"
+        "    state['active'] -= 1\n"
+        "    return key.upper()\n"
+        "\n"
+        "class Plugin:\n"
+        "    def functions(self):\n"
+        "        return [lookup]\n"
+    )
+    input_path = tmp_path / "input"
+    input_path.mkdir()
+
+    for i in range(8):
+        (input_path / f"page{i}.txt.jinja").write_text(f"{{{{ lookup('page{i}') }}}}")
+
+    config = Config(
+        inputs=(input_path,),
+        output=tmp_path / "output",
+        plugins=("async_plugin:Plugin",),
+        quiet=True,
+        internal=Internal(enable_async=True, async_concurrency=4),
+    )
+    run(config)
+
+    import async_plugin  # type: ignore[import-not-found]
+
+    assert async_plugin.state["max_active"] == 4
+    assert (tmp_path / "output" / "page3.txt").read_text() == "PAGE3"
+
+
+def test_cached_plugin_functions(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """Test that plugin functions declared with `cached` are memoized in memory and on disk."""
+    from makejinja.app import run
+    from makejinja.config import Config
+
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.syspath_prepend(tmp_path)
+    (tmp_path / "cached_plugin.py").write_text(
+        "from makejinja.plugin import cached\n"
+        "\n"
+        "calls = []\n"
+        "\n"
+        "@cached(persist=True)\n"
+        "def resolve(name):\n"
+        "    calls.append(name)\n"
+        "    return name.upper()\n"
+        "\n"
+        "class Plugin:\n"
+        "    def filters(self):\n"
+        "        return [resolve]\n"
+    )
+    input_path = tmp_path / "input"
+    input_path.mkdir()
+
+    for i in range(3):
+        (input_path / f"page{i}.txt.jinja").write_text("{{ 'a' | resolve }}")
+
+    config = Config(
+        inputs=(input_path,),
+        output=tmp_path / "output",
+        plugins=("cached_plugin:Plugin",),
+        force=True,
+        quiet=True,
+    )
+    run(config)
+
+    import cached_plugin  # type: ignore[import-not-found]
+
+    assert cached_plugin.calls == ["a"]
+    assert (tmp_path / "output" / "page0.txt").read_text() == "A"
+
+    # A new run only uses the results persisted on disk
+    cached_plugin.calls.clear()
+    run(config)
+    assert cached_plugin.calls == []
+
+
+def test_lazy_imports():
+    """Test that modules only needed for rendering are not imported when starting the CLI."""
+    lazy_modules = (
+        "asyncio",
+        "concurrent.futures",
+        "ctypes",
+        "jinja2",
+        "makejinja.app",
+        "makejinja.watch",
+        "yaml",
+    )
+    env = {**os.environ, "PYTHONPATH": str(Path(__file__).parents[1] / "src")}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import makejinja.cli"],
+        capture_output=True,
+        check=True,
+        env=env,
+        text=True,
+    )
+    # Lines look like `import time: self [us] | cumulative | imported package`
+    timings = {
+        name.strip(): int(cumulative)
+        for line in result.stderr.splitlines()[1:]
+        for _, cumulative, name in [line.removeprefix("import time:").split("|")]
+    }
+
+    assert not any(module in timings for module in lazy_modules)
+    # About 1.5 times the cost (in microseconds) measured on a typical machine,
+    # mostly spent in `rich_click` and `typed_settings`
+    assert timings["makejinja.cli"] < 300_000
+
+    import jinja2.defaults
+
+    from makejinja import config
+
+    # The defaults repeated to avoid importing Jinja have to match
+    for name in (
+        "BLOCK_START_STRING",
+        "BLOCK_END_STRING",
+        "VARIABLE_START_STRING",
+        "VARIABLE_END_STRING",
+        "COMMENT_START_STRING",
+        "COMMENT_END_STRING",
+        "LINE_STATEMENT_PREFIX",
+        "LINE_COMMENT_PREFIX",
+        "NEWLINE_SEQUENCE",
+    ):
+        assert getattr(config, name) == getattr(jinja2.defaults, name)
+
+    assert config.Undefined.strict.jinja_class is jinja2.StrictUndefined
+
+
+def test_batch(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """Test that batch jobs are run independently and share compiled templates."""
+    from makejinja.cache import init_bytecode_cache, share_bytecode_caches
+    from makejinja.cli import makejinja_cli
+    from makejinja.config import Config
+
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "input").mkdir()
+    (tmp_path / "input" / "page.txt.jinja").write_text("{{ name }}")
+    jobs = [
+        {"inputs": ["input"], "output": "output1", "data_vars": {"name": "first"}},
+        {"inputs": ["input"], "output": "output2", "data_vars": {"name": "second"}},
+        {"inputs": ["input"]},
+        {"inputs": ["input"], "output": "planned", "plan": True},
+        {"inputs": ["input"], "output": "merged", "merge_shards": ["output1"]},
+    ]
+    (tmp_path / "jobs.jsonl").write_text("\n".join(json.dumps(job) for job in jobs))
+
+    result = CliRunner().invoke(makejinja_cli, ["--batch", "jobs.jsonl", "--quiet"])
+
+    # The invalid third job does not prevent the others from running
+    assert result.exit_code == 1
+    assert "Job 3 failed" in result.output
+    assert (tmp_path / "output1" / "page.txt").read_text() == "first"
+    assert (tmp_path / "output2" / "page.txt").read_text() == "second"
+    # Jobs are dispatched like regular invocations
+    assert "Plan: 1 render" in result.output
+    assert not (tmp_path / "planned").exists()
+    assert (tmp_path / "merged" / "page.txt").read_text() == "first"
+
+    config = Config(inputs=(tmp_path / "input",), output=tmp_path / "output")
+
+    with share_bytecode_caches():
+        cache = init_bytecode_cache(config)
+        assert cache is not None
+        assert init_bytecode_cache(evolve(config, output=tmp_path / "other")) is cache
+        assert (
+            init_bytecode_cache(evolve(config, extensions=("jinja2.ext.do",)))
+            is not cache
+        )
+
+    assert init_bytecode_cache(config) is None
+
+
+def test_serve(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
+):
+    """Test that jobs sent to a server are run and their output is returned to the client."""
+    from makejinja.batch import connect
+
+    # Jobs without a working dir are run in the one of the client
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "input").mkdir()
+    (tmp_path / "input" / "page.txt.jinja").write_text("{{ name }}")
+    socket_path = tmp_path / "makejinja.sock"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "makejinja", "--serve", str(socket_path)],
+        cwd=tmp_path,
+        env={**os.environ, "PYTHONPATH": str(Path(__file__).parents[1] / "src")},
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+
+    try:
+        assert server.stderr is not None
+        assert "Listening for jobs" in server.stderr.readline()
+        assert stat.S_IMODE(socket_path.stat().st_mode) == 0o600
+
+        jobs = [
+            {
+                "inputs": ["input"],
+                "output": "output",
+                "data_vars": {"name": "first"},
+                "profile": True,
+            },
+            {"inputs": ["missing"]},
+        ]
+        success = connect(socket_path, (json.dumps(job) for job in jobs))
+    finally:
+        server.send_signal(signal.SIGINT)
+        server.wait(timeout=10)
+
+    assert not success
+    assert (tmp_path / "output" / "page.txt").read_text() == "first"
+
+    # All log messages of a job are sent to the client, including the ones of the rendered files
+    log_output = capsys.readouterr().err
+    assert f"Render file '{tmp_path / 'input' / 'page.txt.jinja'}'" in log_output
+    assert "Summary: 1 rendered" in log_output
+    assert "All durations in milliseconds." in log_output
+    assert "Job 2 failed" in log_output
+    assert not socket_path.exists()
+
+
+def test_listings_loader(tmp_path: Path):
+    """Test that templates are looked up in the recorded listings with the same precedence as before."""
+    from makejinja.app import ListingsLoader, run
+    from makejinja.config import Config
+
+    first = tmp_path / "first"
+    second = tmp_path / "second"
+    (first / "partials").mkdir(parents=True)
+    (second / "partials").mkdir(parents=True)
+    (first / "page.txt.jinja").write_text(
+        "{% include 'a.partial' %}{% include 'partials/b.partial' %}"
+    )
+    (first / "a.partial").write_text("first a;")
+    (second / "a.partial").write_text("second a;")
+    # The excluded dir of the first input is not scanned, but still takes precedence
+    (first / "partials" / "b.partial").write_text("first b")
+    (second / "partials" / "b.partial").write_text("second b")
+    (second / "partials" / "c.partial").write_text("second c")
+
+    config = Config(
+        inputs=(first, second),
+        output=tmp_path / "output",
+        exclude_patterns=("*.partial", "partials"),
+        force=True,
+        quiet=True,
+    )
+    state = run(config)
+
+    assert (tmp_path / "output" / "page.txt").read_text() == "first a;first b"
+    assert str(first) in state.listings
+    assert str(first / "partials") not in state.listings
+
+    template = state.env.get_template("partials/c.partial")
+    assert template.render() == "second c"
+    assert template.is_up_to_date
+
+    os.utime(second / "partials" / "c.partial", ns=(0, 0))
+    assert not template.is_up_to_date
+
+    with pytest.raises(TemplateNotFound):
+        state.env.get_template("missing.partial")
+
+    # The sources kept in memory are limited like the template cache
+    for cache_size, expected in [
+        (0, []),
+        (1, ["b.partial"]),
+        (-1, ["a.partial", "b.partial"]),
+    ]:
+        loader = ListingsLoader([first / "partials", second], {}, cache_size=cache_size)
+        loader.get_source(state.env, "a.partial")
+        loader.get_source(state.env, "b.partial")
+
+        assert [Path(filename).name for filename in loader._sources] == expected
+
+
+def test_parallel_data_loading(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """Test that data files are parsed by worker processes and result in the same data."""
+    from makejinja.app import clear_parsed_data, load_data
+    from makejinja.config import Config, Internal
+
+    monkeypatch.syspath_prepend(tmp_path)
+    # Records the process parsing every file
+    (tmp_path / "pid_loader.py").write_text(
+        "import os\n\ndef load(path):\n    return {f'pid{path.stem}': os.getpid()}\n"
+    )
+    data_path = tmp_path / "data"
+    data_path.mkdir()
+
+    for i in range(20):
+        # Later files override earlier ones
+        (data_path / f"{i:02}.yaml").write_text(f"last: {i}\nvalue{i}: {i}\n")
+        (data_path / f"{i:02}.pid").write_text("")
+
+    config = Config(
+        inputs=(),
+        output=tmp_path / "output",
+        data=(data_path,),
+        data_loaders={".pid": "pid_loader:load"},
+        quiet=True,
+        internal=Internal(data_cache=False),
+    )
+    parallel_config = evolve(
+        config,
+        jobs=2,
+        internal=Internal(data_cache=False, data_jobs_threshold=2),
+    )
+
+    def without_pids(data: abc.Mapping[str, Any]) -> dict[str, Any]:
+        return {key: value for key, value in data.items() if not key.startswith("pid")}
+
+    serial_data = load_data(config)
+    # Otherwise, the files parsed above would be reused
+    clear_parsed_data()
+    parallel_data = load_data(parallel_config)
+
+    assert without_pids(parallel_data) == without_pids(serial_data)
+    assert parallel_data["last"] == 19
+    # The files have actually been parsed by worker processes
+    assert {serial_data[f"pid{i:02}"] for i in range(20)} == {os.getpid()}
+    assert os.getpid() not in {parallel_data[f"pid{i:02}"] for i in range(20)}
+
+
+@pytest.mark.parametrize(
+    "strategy, expected",
+    [
+        ("shallow", {"a": {"y": [2]}, "b": {"c": 1}}),
+        ("deep", {"a": {"x": 1, "y": [2]}, "b": {"c": 1}}),
+        ("append", {"a": {"x": 1, "y": [1, 2]}, "b": {"c": 1}}),
+    ],
+)
+def test_data_merge(strategy: str, expected: dict[str, Any]):
+    """Test that every merge strategy combines nested mappings and lists as documented."""
+    from makejinja.config import MergeStrategy
+    from makejinja.merging import DataMerger
+
+    first = {"a": {"x": 1, "y": [1]}, "b": {"c": 1}}
+    second = {"a": {"y": [2]}}
+    merger = DataMerger(MergeStrategy[strategy])
+    data: dict[str, Any] = {}
+    merger.merge(data, first)
+    merger.merge(data, second)
+
+    assert data == expected
+    # The merged data are neither copied nor modified unless necessary
+    assert data["b"] is first["b"]
+    assert first == {"a": {"x": 1, "y": [1]}, "b": {"c": 1}}
+    assert second == {"a": {"y": [2]}}
+
+    merger.set(data, ["b", "d"], 2)
+    assert data["b"] == {"c": 1, "d": 2}
+    assert first["b"] == {"c": 1}
+
+
+def test_deep_data_merge(tmp_path: Path):
+    """Test that data files and variables are merged with the configured strategy."""
+    from makejinja.app import load_data
+    from makejinja.config import Config, MergeStrategy
+
+    data_path = tmp_path / "data"
+    data_path.mkdir()
+    (data_path / "1.yaml").write_text("app:\n  name: demo\n  ports: [80]\n")
+    (data_path / "2.yaml").write_text("app:\n  ports: [443]\n")
+
+    config = Config(
+        inputs=(),
+        output=tmp_path / "output",
+        data=(data_path,),
+        data_vars={"app.env": "prod"},
+        data_merge=MergeStrategy.append,
+        quiet=True,
+    )
+
+    assert load_data(config) == {
+        "app": {"name": "demo", "ports": [80, 443], "env": "prod"}
+    }
+
+
+def test_plan(tmp_path: Path):
+    """Test that planning a run lists its steps without rendering or creating anything."""
+    from makejinja.app import run
+    from makejinja.config import Config
+    from makejinja.planning import Action, plan
+
+    input_path = tmp_path / "input"
+    output_path = tmp_path / "output"
+    input_path.mkdir()
+    (input_path / "a.txt.jinja").write_text("a")
+    (input_path / "b.txt.jinja").write_text("b")
+    (input_path / "c.bin").write_bytes(b"c")
+    (input_path / "sub").mkdir()
+    (input_path / "sub" / "d.partial").write_text("d")
+
+    config = Config(
+        inputs=(input_path,),
+        output=output_path,
+        exclude_patterns=("*.partial",),
+        incremental=True,
+        quiet=True,
+    )
+
+    assert [(step.action, step.path.name) for step in plan(config)] == [
+        (Action.create, "sub"),
+        (Action.skip, "d.partial"),
+        (Action.render, "a.txt.jinja"),
+        (Action.render, "b.txt.jinja"),
+        (Action.copy, "c.bin"),
+    ]
+    assert not output_path.exists()
+
+    run(config)
+    (input_path / "a.txt.jinja").write_text("changed")
+    (input_path / "b.txt.jinja").unlink()
+    steps = plan(config)
+
+    # The empty dir has been removed after the run
+    assert [(step.action, step.path.name) for step in steps] == [
+        (Action.create, "sub"),
+        (Action.skip, "d.partial"),
+        (Action.render, "a.txt.jinja"),
+        (Action.up_to_date, "c.bin"),
+        (Action.remove, "b.txt"),
+    ]
+    # The duration recorded by the previous run is the estimated cost
+    assert steps[2].cost is not None
+    assert (output_path / "b.txt").exists()
+
+
+def test_shards(tmp_path: Path):
+    """Test that merging the outputs of all shards results in the same output as a single run."""
+    from makejinja.app import capture_log, makejinja
+    from makejinja.config import Config
+    from makejinja.manifest import MANIFEST_NAME, Manifest
+    from makejinja.planning import Action, plan
+    from makejinja.sharding import partition
+
+    assert partition([1, 5, 3, 3], 2) == [0, 0, 1, 1]
+    assert partition([1, 5, 3, 3], 2, [None, 1, None, None]) == [1, 1, 0, 0]
+
+    input_path = tmp_path / "input"
+    (input_path / "empty").mkdir(parents=True)
+    (input_path / "empty" / "x.partial").write_text("")
+
+    for i in range(6):
+        (input_path / f"page{i}.txt.jinja").write_text("x" * i)
+
+    config = Config(
+        inputs=(input_path,),
+        output=tmp_path / "full",
+        exclude_patterns=("*.partial",),
+        incremental=True,
+        quiet=True,
+    )
+    makejinja(config)
+    shard_outputs = []
+
+    for shard in ("1/2", "2/2"):
+        shard_output = tmp_path / f"shard{shard[0]}"
+        makejinja(evolve(config, output=shard_output, shard=shard))
+        shard_outputs.append(shard_output)
+
+    shard_files = [{path.name for path in x.glob("*.txt")} for x in shard_outputs]
+    assert shard_files[0].isdisjoint(shard_files[1])
+
+    # Planning a shard only considers the outputs of that shard
+    for shard, shard_output in zip(("1/2", "2/2"), shard_outputs):
+        steps = plan(evolve(config, output=shard_output, shard=shard))
+        outputs = Manifest.load(shard_output / MANIFEST_NAME).outputs
+
+        assert {step.output.name for step in steps if step.output} == outputs.keys()
+        assert not {Action.render, Action.remove} & {step.action for step in steps}
+
+    # Empty dirs are only removed after merging
+    assert (tmp_path / "shard1" / "empty").is_dir()
+
+    merged_output = tmp_path / "merged"
+    makejinja(evolve(config, output=merged_output, merge_shards=tuple(shard_outputs)))
+
+    def tree(path: Path) -> set[Path]:
+        return {x.relative_to(path) for x in path.rglob("*")}
+
+    assert tree(merged_output) == tree(tmp_path / "full")
+    assert not (merged_output / "empty").exists()
+
+    # All shards balance their parts by the durations recorded in the merged manifest
+    shard_config = evolve(
+        config, shard_manifest=merged_output / MANIFEST_NAME, quiet=False
+    )
+
+    def run_shards() -> str:
+        with capture_log() as messages:
+            for shard, shard_output in zip(("1/2", "2/2"), shard_outputs):
+                makejinja(evolve(shard_config, output=shard_output, shard=shard))
+
+            makejinja(
+                evolve(config, output=merged_output, merge_shards=tuple(shard_outputs))
+            )
+
+        shard_files = [{path.name for path in x.glob("*.txt")} for x in shard_outputs]
+        assert shard_files[0].isdisjoint(shard_files[1])
+        assert tree(merged_output) == tree(tmp_path / "full")
+
+        return "\n".join(messages)
+
+    # Files stay on the shard recorded in the merged manifest
+    assert "Render file" not in run_shards()
+
+    (input_path / "page5.txt.jinja").write_text("changed")
+    log_output = run_shards()
+
+    assert log_output.count("Render file") == 1
+    assert "page5.txt.jinja" in log_output
+    assert (merged_output / "page5.txt").read_text() == "changed"
+
+
+def test_remove_empty_dirs(tmp_path: Path):
+    """Test that output dirs left empty after rendering are removed, but not those with foreign files."""
+    from makejinja.app import makejinja
+    from makejinja.config import Config
+
+    input_path = tmp_path / "input"
+    (input_path / "a" / "b" / "c").mkdir(parents=True)
+    (input_path / "a" / "b" / "c" / "empty.txt.jinja").write_text("")
+    (input_path / "d" / "e").mkdir(parents=True)
+    (input_path / "d" / "e" / "page.txt.jinja").write_text("page")
+    (input_path / "f").mkdir()
+
+    output_path = tmp_path / "output"
+    (output_path / "f").mkdir(parents=True)
+    (output_path / "f" / "foreign.txt").write_text("foreign")
+
+    config = Config(inputs=(input_path,), output=output_path, quiet=True)
+
+    # Empty outputs that are up to date in the second incremental run do not keep their dir
+    for incremental in (False, True, True):
+        makejinja(evolve(config, incremental=incremental))
+
+        # Empty dirs are removed even if they only contained empty dirs
+        assert not (output_path / "a").exists()
+        assert (output_path / "d" / "e" / "page.txt").read_text() == "page"
+        # Files not written by the run keep their dir
+        assert (output_path / "f" / "foreign.txt").exists()